@@ -1,61 +1,117 @@
+import functools
+from typing import NamedTuple
 from crewai import Agent
+from langchain.prompts import PromptTemplate
 from config import llm
-from tools import file_read_tool, generate_image_flux, convert_markdown_to_pdf
+from tools import generate_image_flux, generate_images_batch, convert_markdown_to_pdf
 
-# Story Outliner Agent
-def create_story_outliner(topic: str):
-    return Agent(
+# House style guide shared by every agent that shapes the book. It is pinned to the
+# end of each backstory (part of the system prompt), so the tasks need not repeat it
+# and the same bytes lead every request
+STYLE_GUIDE_MD = """
+## Storybook Style Guide
+- Audience: children aged 4-8; age-appropriate language, vocabulary, themes and lessons
+- Structure: a story title and exactly 5 chapters, each approximately 100 words with a clear beginning, middle and conclusion
+- Voice: engaging narration with dialogue and description, consistent character voices
+- Illustrations: child-friendly, whimsical storybook art in one consistent style across all chapters
+- Typography: serif body text (Georgia, Times New Roman), sans-serif headings, left-aligned text, comfortable line spacing
+- Layout: print-ready margins, each chapter starting on a new page with its image at the top
+"""
+
+def _with_style_guide(backstory):
+    return backstory + "\n" + STYLE_GUIDE_MD
+
+# Topic-dependent goals, compiled once so the same topic always yields the same prompt bytes
+_OUTLINER_GOAL_T = PromptTemplate.from_template(
+    "Develop an outline for a children's storybook about {topic}, including chapter titles and characters for 5 chapters."
+)
+_WRITER_GOAL_T = PromptTemplate.from_template(
+    "Write the full content of the story about {topic} for all 5 chapters, each chapter 100 words, weaving together the narratives and characters outlined."
+)
+
+_OUTLINER_BACKSTORY = "An imaginative creator who lays the foundation of captivating stories for children. You specialize in creating engaging narratives that teach valuable lessons while entertaining young readers."
+_WRITER_BACKSTORY = "A talented storyteller who brings to life the world and characters outlined, crafting engaging and imaginative tales for children. You have a gift for creating age-appropriate content that captures young imaginations."
+_IMAGE_GENERATOR_GOAL = 'Generate one image per chapter content provided by the story writer. Create totally 5 images, one for each chapter, in a single batch request. Each image should capture the essence of the chapter with detailed character and location information. If image generation fails, provide placeholder text descriptions.'
+_IMAGE_GENERATOR_BACKSTORY = "A creative AI specialized in visual storytelling, bringing each chapter to life through imaginative imagery. You excel at creating whimsical, child-friendly illustrations that complement the narrative perfectly. When technical issues arise, you provide detailed image descriptions as fallbacks."
+_PDF_CREATOR_GOAL = 'Convert the formatted Markdown file to a professional PDF document using available tools. Try multiple conversion methods if needed.'
+_PDF_CREATOR_BACKSTORY = 'An efficient converter that transforms Markdown files into professionally formatted PDF documents. You ensure that all formatting and layout are preserved in the final PDF output. You have multiple conversion strategies available.'
+
+# Every piece of agent prompt text; hashed into the cache version (see crew.py)
+AGENT_PROMPTS = (
+    STYLE_GUIDE_MD,
+    _OUTLINER_GOAL_T.template, _OUTLINER_BACKSTORY,
+    _WRITER_GOAL_T.template, _WRITER_BACKSTORY,
+    _IMAGE_GENERATOR_GOAL, _IMAGE_GENERATOR_BACKSTORY,
+    _PDF_CREATOR_GOAL, _PDF_CREATOR_BACKSTORY
+)
+
+# Constant fields of the Story Outliner Agent; only the goal depends on the topic
+@functools.lru_cache(maxsize=1)
+def _story_outliner_template():
+    return dict(
         role='Story Outliner',
-        goal=f'Develop an outline for a children\'s storybook about {topic}, including chapter titles and characters for 5 chapters.',
-        backstory="An imaginative creator who lays the foundation of captivating stories for children. You specialize in creating engaging narratives that teach valuable lessons while entertaining young readers.",
+        backstory=_with_style_guide(_OUTLINER_BACKSTORY),
         verbose=True,
         llm=llm,
         allow_delegation=False
     )
 
-# Story Writer Agent
-def create_story_writer(topic: str):
+# Story Outliner Agent (one per topic, reused for repeat topics)
+@functools.lru_cache(maxsize=8)
+def create_story_outliner(topic: str):
     return Agent(
+        goal=_OUTLINER_GOAL_T.format(topic=topic),
+        **_story_outliner_template()
+    )
+
+# Constant fields of the Story Writer Agent; only the goal depends on the topic
+@functools.lru_cache(maxsize=1)
+def _story_writer_template():
+    return dict(
         role='Story Writer',
-        goal=f'Write the full content of the story about {topic} for all 5 chapters, each chapter 100 words, weaving together the narratives and characters outlined.',
-        backstory="A talented storyteller who brings to life the world and characters outlined, crafting engaging and imaginative tales for children. You have a gift for creating age-appropriate content that captures young imaginations.",
+        backstory=_with_style_guide(_WRITER_BACKSTORY),
         verbose=True,
         llm=llm,
         allow_delegation=False
     )
 
-# Image Generator Agent
-def create_image_generator():
+# Story Writer Agent (one per topic, reused for repeat topics)
+@functools.lru_cache(maxsize=8)
+def create_story_writer(topic: str):
     return Agent(
-        role='Image Generator',
-        goal='Generate one image per chapter content provided by the story writer. Create totally 5 images, one for each chapter. Each image should capture the essence of the chapter with detailed character and location information. If image generation fails, provide placeholder text descriptions.',
-        backstory="A creative AI specialized in visual storytelling, bringing each chapter to life through imaginative imagery. You excel at creating whimsical, child-friendly illustrations that complement the narrative perfectly. When technical issues arise, you provide detailed image descriptions as fallbacks.",
-        verbose=True,
-        llm=llm,
-        tools=[generate_image_flux],
-        allow_delegation=False
+        goal=_WRITER_GOAL_T.format(topic=topic),
+        **_story_writer_template()
     )
 
-# Content Formatter Agent
-def create_content_formatter():
+# Image Generator Agent (topic independent, built once per process)
+@functools.lru_cache(maxsize=1)
+def create_image_generator():
     return Agent(
-        role='Content Formatter',
-        goal='Format the written story content in markdown, including images at the beginning of each chapter, following the template structure. Handle missing images gracefully by using placeholder descriptions.',
-        backstory='A meticulous formatter who enhances the readability and presentation of the storybook. You ensure that the final product is professionally formatted and visually appealing for both digital and print formats. You adapt gracefully when images are unavailable.',
+        role='Image Generator',
+        goal=_IMAGE_GENERATOR_GOAL,
+        backstory=_with_style_guide(_IMAGE_GENERATOR_BACKSTORY),
         verbose=True,
         llm=llm,
-        tools=[file_read_tool],
+        tools=[generate_images_batch, generate_image_flux],
         allow_delegation=False
     )
 
-# PDF Converter Agent
+# PDF Converter Agent (topic independent, built once per process)
+@functools.lru_cache(maxsize=1)
 def create_markdown_to_pdf_creator():
     return Agent(
         role='PDF Converter',
-        goal='Convert the formatted Markdown file to a professional PDF document using available tools. Try multiple conversion methods if needed.',
-        backstory='An efficient converter that transforms Markdown files into professionally formatted PDF documents. You ensure that all formatting and layout are preserved in the final PDF output. You have multiple conversion strategies available.',
+        goal=_PDF_CREATOR_GOAL,
+        backstory=_PDF_CREATOR_BACKSTORY,
         verbose=True,
         llm=llm,
         tools=[convert_markdown_to_pdf],
         allow_delegation=False
-    )
\ No newline at end of file
+    )
+
+# The crew's agents, in pipeline order
+class StorybookAgents(NamedTuple):
+    story_outliner: Agent
+    story_writer: Agent
+    image_generator: Agent
+    markdown_to_pdf_creator: Agent
@@ -0,0 +1,412 @@
+import hashlib
+import json
+import os
+import pickle
+import re
+import shutil
+import sqlite3
+import threading
+import time
+import traceback
+
+def topic_key(topic):
+    """Stable SHA256 key of a story topic, ignoring case and surrounding whitespace"""
+    return hashlib.sha256(topic.strip().lower().encode('utf-8')).hexdigest()
+
+def text_version(*texts):
+    """Stable integer version of some texts (fits a SQLite INTEGER); editing any text changes it"""
+    digest = hashlib.sha256("\0".join(texts).encode('utf-8')).hexdigest()
+    return int(digest[:15], 16)
+
+# Exact-match LLM response cache backed by a SQLite file
+class LLMResponseCache:
+    def __init__(self, path, ttl_seconds=7 * 86400):
+        """
+        Initialize the response cache
+
+        Args:
+            path (str): Path of the SQLite file holding cached responses
+            ttl_seconds (int): How long a cached response stays valid
+                               Default is 7 days
+        """
+        self.path = path
+        self.ttl_seconds = ttl_seconds
+        self.lock = threading.Lock()
+        self.conn = sqlite3.connect(path, check_same_thread=False)
+        self.conn.execute(
+            "CREATE TABLE IF NOT EXISTS responses ("
+            "key TEXT PRIMARY KEY, value BLOB NOT NULL, expires_at REAL NOT NULL)"
+        )
+        self.conn.commit()
+
+    @staticmethod
+    def make_key(*parts):
+        """Build a deterministic SHA256 key from JSON-serializable parts"""
+        payload = json.dumps(parts, sort_keys=True, default=str)
+        return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+    def get(self, key):
+        """Return the cached value for key, or None on a miss or expired entry"""
+        with self.lock:
+            row = self.conn.execute(
+                "SELECT value, expires_at FROM responses WHERE key = ?", (key,)
+            ).fetchone()
+        if row is None:
+            return None
+
+        value, expires_at = row
+        if expires_at < time.time():
+            self.delete(key)
+            return None
+
+        try:
+            return pickle.loads(value)
+        except Exception:
+            # Stale entry from an incompatible library version
+            self.delete(key)
+            return None
+
+    def set(self, key, value):
+        """Store value under key"""
+        blob = pickle.dumps(value)
+        with self.lock:
+            self.conn.execute(
+                "INSERT OR REPLACE INTO responses (key, value, expires_at) VALUES (?, ?, ?)",
+                (key, blob, time.time() + self.ttl_seconds)
+            )
+            self.conn.commit()
+
+    def delete(self, key):
+        """Remove a cached entry"""
+        with self.lock:
+            self.conn.execute("DELETE FROM responses WHERE key = ?", (key,))
+            self.conn.commit()
+
+# Semantic LLM response cache: entries live in SQLite (embeddings as float32 BLOBs)
+# and are loaded into an in-process FAISS inner-product index at startup
+class SemanticCache:
+    # Above this many entries, an approximate HNSW index replaces the exact flat index
+    HNSW_THRESHOLD = 100_000
+
+    def __init__(self, path, embed_fn, threshold=0.93, ttl_seconds=7 * 86400, version=1):
+        """
+        Initialize the semantic cache
+
+        Args:
+            path (str): Path of the SQLite file holding embeddings and cached responses
+            embed_fn (callable): Function turning prompt text into an embedding vector
+            threshold (float): Minimum cosine similarity for a prompt to count as a hit
+            ttl_seconds (int): How long a cached response stays valid
+            version (int): Entries stored under a different version are ignored
+        """
+        import faiss
+        import numpy as np
+
+        self.faiss = faiss
+        self.np = np
+        self.embed_fn = embed_fn
+        self.threshold = threshold
+        self.ttl_seconds = ttl_seconds
+        self.version = version
+        self.lock = threading.Lock()
+        self.conn = sqlite3.connect(path, check_same_thread=False)
+        self.conn.execute(
+            "CREATE TABLE IF NOT EXISTS semantic_responses ("
+            "id INTEGER PRIMARY KEY, embedding BLOB NOT NULL, value BLOB NOT NULL, "
+            "version INTEGER NOT NULL, expires_at REAL NOT NULL)"
+        )
+        self.conn.execute("DELETE FROM semantic_responses WHERE expires_at < ?", (time.time(),))
+        self.conn.commit()
+
+        # Index position -> (row id, expires_at); values are read from SQLite on a hit
+        self.index = None
+        self.entries = []
+        rows = self.conn.execute(
+            "SELECT id, embedding, expires_at FROM semantic_responses WHERE version = ? ORDER BY id",
+            (version,)
+        ).fetchall()
+        if rows:
+            matrix = np.vstack([np.frombuffer(embedding, dtype='float32') for _, embedding, _ in rows])
+            self.index = self._new_index(matrix.shape[1], len(rows))
+            self.index.add(matrix)
+            self.entries = [(row_id, expires_at) for row_id, _, expires_at in rows]
+
+    def _new_index(self, dim, size):
+        if size > self.HNSW_THRESHOLD:
+            return self.faiss.IndexHNSWFlat(dim, 32, self.faiss.METRIC_INNER_PRODUCT)
+        return self.faiss.IndexFlatIP(dim)
+
+    def _embed(self, text):
+        """Embed text as an L2-normalized (1, dim) float32 matrix"""
+        vec = self.np.asarray(self.embed_fn(text), dtype='float32').reshape(1, -1)
+        self.faiss.normalize_L2(vec)
+        return vec
+
+    def lookup(self, text):
+        """
+        Find the closest cached prompt
+
+        Returns:
+            tuple: (cached response or None, embedding of text or None)
+        """
+        try:
+            vec = self._embed(text)
+        except Exception as e:
+            print(f"⚠️  Semantic cache embedding failed: {e}")
+            return None, None
+
+        with self.lock:
+            if self.index is None or self.index.ntotal == 0:
+                return None, vec
+            scores, ids = self.index.search(vec, 1)
+            if ids[0][0] < 0 or scores[0][0] < self.threshold:
+                return None, vec
+            row_id, expires_at = self.entries[ids[0][0]]
+            if expires_at < time.time():
+                return None, vec
+            row = self.conn.execute(
+                "SELECT value FROM semantic_responses WHERE id = ?", (row_id,)
+            ).fetchone()
+
+        if row is None:
+            return None, vec
+        try:
+            return pickle.loads(row[0]), vec
+        except Exception:
+            return None, vec
+
+    def add(self, vec, value):
+        """Store a response under a prompt embedding returned by lookup()"""
+        blob = pickle.dumps(value)
+        expires_at = time.time() + self.ttl_seconds
+        with self.lock:
+            cursor = self.conn.execute(
+                "INSERT INTO semantic_responses (embedding, value, version, expires_at) VALUES (?, ?, ?, ?)",
+                (vec.tobytes(), blob, self.version, expires_at)
+            )
+            self.conn.commit()
+
+            if self.index is None:
+                self.index = self._new_index(vec.shape[1], 1)
+            self.index.add(vec)
+            self.entries.append((cursor.lastrowid, expires_at))
+
+# Per-topic task output checkpoints, so a failed run resumes where it stopped
+class TaskCheckpoints:
+    def __init__(self, root, topic):
+        """
+        Initialize the checkpoint store for one topic
+
+        Args:
+            root (str): Directory holding one checkpoint folder per topic
+            topic (str): The story topic; its hash names the checkpoint folder
+        """
+        self.topic = topic
+        self.path = os.path.join(root, topic_key(topic)[:16])
+
+    def _artifact(self, name):
+        return os.path.join(self.path, f"{name}.json")
+
+    def _marker(self, name):
+        return os.path.join(self.path, f"{name}.done")
+
+    def load(self, names):
+        """
+        Return the saved outputs of completed tasks
+
+        A task counts as complete only if both its JSON output and the sibling
+        .done marker exist and the output is non-empty.
+
+        Returns:
+            dict: Task name -> saved output text, for the completed tasks in names
+        """
+        saved = {}
+        for name in names:
+            if not os.path.exists(self._marker(name)):
+                continue
+            try:
+                with open(self._artifact(name), 'r', encoding='utf-8') as f:
+                    output = json.load(f).get('output')
+            except (OSError, ValueError) as e:
+                print(f"⚠️  Ignoring unreadable checkpoint for {name}: {e}")
+                continue
+            if output:
+                saved[name] = output
+        return saved
+
+    def save(self, name, output):
+        """Atomically write a task's output, then mark it complete"""
+        os.makedirs(self.path, exist_ok=True)
+        tmp_path = self._artifact(name) + ".tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump({'task': name, 'topic': self.topic, 'output': output, 'saved_at': time.time()}, f)
+        os.replace(tmp_path, self._artifact(name))
+        open(self._marker(name), 'w').close()
+
+    def callback(self, name, then=None, to_text=str):
+        """
+        Build a CrewAI task callback that checkpoints the output text, then calls then.
+        An output for which to_text returns None is not checkpointed, so it is redone on resume.
+        """
+        def _checkpoint(task_output):
+            try:
+                text = to_text(task_output)
+                if text is not None:
+                    self.save(name, text.strip())
+            except OSError as e:
+                print(f"⚠️  Could not checkpoint {name}: {e}")
+            if then is not None:
+                then(task_output)
+        return _checkpoint
+
+    def log_failure(self, error):
+        """Append a failed run, with its full traceback, to failures.jsonl"""
+        os.makedirs(self.path, exist_ok=True)
+        record = {
+            'topic': self.topic,
+            'time': time.time(),
+            'error': repr(error),
+            'traceback': ''.join(traceback.format_exception(type(error), error, error.__traceback__))
+        }
+        with open(os.path.join(self.path, "failures.jsonl"), 'a', encoding='utf-8') as f:
+            f.write(json.dumps(record) + "\n")
+
+    def clear(self):
+        """Drop the checkpoints after a successful run"""
+        if os.path.isdir(self.path):
+            for entry in os.listdir(self.path):
+                if entry.endswith(('.json', '.done', '.tmp')):
+                    os.remove(os.path.join(self.path, entry))
+
+# Topics about current events go stale quickly; classic storybook themes do not
+# (only words that really signal news: "a new friend" or "ocean currents" are ordinary topics)
+_VOLATILE_TOPIC_RE = re.compile(r"\b(today|news|latest|trending|this (week|month|year)|20\d\d)\b", re.IGNORECASE)
+_EVERGREEN_TOPIC_WORDS = frozenset({
+    'animal', 'animals', 'dinosaur', 'dinosaurs', 'dragon', 'dragons', 'fairy', 'friendship',
+    'kindness', 'family', 'magic', 'ocean', 'sea', 'space', 'planets', 'seasons', 'nature',
+    'forest', 'farm', 'pets', 'princess', 'pirates', 'bedtime', 'sharing', 'courage'
+})
+
+def topic_ttl(topic, default_seconds):
+    """
+    Pick how long a storybook about topic stays cached
+
+    Returns:
+        int: 1 hour for news-like topics, 30 days for classic storybook themes,
+             otherwise default_seconds
+    """
+    if _VOLATILE_TOPIC_RE.search(topic):
+        return 3600
+    if _EVERGREEN_TOPIC_WORDS.intersection(re.findall(r"[a-z]+", topic.lower())):
+        return 30 * 86400
+    return default_seconds
+
+# Finished storybooks, keyed on the normalized topic, so a repeated topic is served from disk
+class StorybookCache:
+    def __init__(self, root, ttl_seconds=7 * 86400, fingerprint=None, max_entries=200, required_files=()):
+        """
+        Initialize the storybook cache
+
+        Args:
+            root (str): Directory holding one folder per cached storybook
+            ttl_seconds (int): How long a cached storybook stays valid when its topic
+                               is neither news-like nor a classic theme (see topic_ttl)
+            fingerprint (dict): Generation settings (models, cache version); a storybook
+                                built with different settings is not reused
+            max_entries (int): Beyond this many storybooks, the least used one is evicted
+            required_files (tuple): File names every cached storybook must include;
+                                    a run without them is not stored nor served
+        """
+        self.root = root
+        self.ttl_seconds = ttl_seconds
+        self.fingerprint = fingerprint or {}
+        self.max_entries = max_entries
+        self.required_files = tuple(required_files)
+
+    def _path(self, topic):
+        return os.path.join(self.root, topic_key(topic))
+
+    @staticmethod
+    def _read_meta(path):
+        try:
+            with open(os.path.join(path, "meta.json"), 'r', encoding='utf-8') as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+    @staticmethod
+    def _write_meta(path, meta):
+        tmp_path = os.path.join(path, "meta.json.tmp")
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(meta, f)
+        os.replace(tmp_path, os.path.join(path, "meta.json"))
+
+    def _expires_at(self, meta):
+        """Expiry of an entry; entries stored before per-topic TTLs expire ttl_seconds after creation"""
+        return meta.get('expires_at', meta.get('created_at', 0) + self.ttl_seconds)
+
+    def get(self, topic):
+        """
+        Return the cached output files of a topic
+
+        Returns:
+            list: Paths of the cached files, or None on a miss, stale or foreign entry
+        """
+        path = self._path(topic)
+        meta = self._read_meta(path)
+        if meta is None:
+            return None
+
+        if meta.get('fingerprint') != self.fingerprint or self._expires_at(meta) < time.time():
+            return None
+        names = meta.get('files', [])
+        if not names or not all(name in names for name in self.required_files):
+            return None
+        files = [os.path.join(path, name) for name in names]
+        if not all(os.path.exists(f) for f in files):
+            return None
+
+        meta['hits'] = meta.get('hits', 0) + 1
+        self._write_meta(path, meta)
+        return files
+
+    def put(self, topic, files):
+        """Copy the finished output files into the cache; missing optional files are skipped"""
+        files = [f for f in files if os.path.exists(f)]
+        names = [os.path.basename(f) for f in files]
+        if not files or not all(name in names for name in self.required_files):
+            return
+        path = self._path(topic)
+        os.makedirs(path, exist_ok=True)
+        for f in files:
+            shutil.copy2(f, os.path.join(path, os.path.basename(f)))
+        now = time.time()
+        self._write_meta(path, {
+            'topic': topic,
+            'created_at': now,
+            'expires_at': now + topic_ttl(topic, self.ttl_seconds),
+            'hits': 0,
+            'fingerprint': self.fingerprint,
+            'files': [os.path.basename(f) for f in files]
+        })
+        self._evict(keep=path)
+
+    def _evict(self, keep):
+        """
+        Drop expired storybooks, then the least used ones (oldest first) beyond
+        max_entries, never the one at keep that was just stored
+        """
+        entries = []
+        for name in os.listdir(self.root):
+            path = os.path.join(self.root, name)
+            meta = self._read_meta(path)
+            if meta is None or path == keep:
+                continue
+            if self._expires_at(meta) < time.time():
+                shutil.rmtree(path, ignore_errors=True)
+            else:
+                entries.append((meta.get('hits', 0), meta.get('created_at', 0), path))
+
+        entries.sort()
+        for _, _, path in entries[:max(0, len(entries) + 1 - self.max_entries)]:
+            shutil.rmtree(path, ignore_errors=True)
@@ -1,181 +1,458 @@
 import os
+import re
 import time
+import asyncio
+import contextvars
 import threading
 from datetime import datetime, timedelta
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 from langchain_google_genai import ChatGoogleGenerativeAI
 from langchain.callbacks.base import BaseCallbackHandler
 import logging
+from cache import LLMResponseCache, SemanticCache, text_version
+
+logger = logging.getLogger(__name__)
 
 # Environment variables - make sure to set these
 GOOGLE_API_KEY = os.getenv("GOOGLE_API_KEY")
 HUGGINGFACE_API_KEY = os.getenv("HUGGINGFACE_API_KEY")
 
-# Rate limiting configuration for Gemini API
-class RateLimiter:
-    def __init__(self, max_requests_per_minute=15):
+# Gemini model configuration
+GEMINI_MODEL = "gemini-2.0-flash-exp"
+GEMINI_TEMPERATURE = 0.7
+GEMINI_MAX_OUTPUT_TOKENS = 2048
+GEMINI_TOP_P = 0.9
+GEMINI_TOP_K = 40
+
+# LLM response cache - set LLM_CACHE=0 to always get fresh generations
+LLM_CACHE_ENABLED = os.getenv("LLM_CACHE", "1") == "1"
+LLM_CACHE_PATH = ".llm_cache.sqlite"
+LLM_CACHE_TTL_SECONDS = 7 * 86400
+LLM_CACHE_VERSION = 1  # Bump to invalidate cached responses after output handling changes; prompt edits are picked up automatically
+
+# Semantic response cache - opt in with LLM_SEMANTIC_CACHE=1 (requires faiss-cpu)
+LLM_SEMANTIC_CACHE_ENABLED = os.getenv("LLM_SEMANTIC_CACHE", "0") == "1"
+LLM_SEMANTIC_THRESHOLD = float(os.getenv("LLM_SEMANTIC_THRESHOLD", "0.93"))
+SEMANTIC_CACHE_PATH = "semcache.sqlite"
+EMBEDDING_MODEL = "models/embedding-001"
+GEMINI_TRANSPORT = "grpc"  # One persistent HTTP/2 channel per client, multiplexing concurrent calls
+
+# Task checkpoints - completed task outputs are kept per topic until the run succeeds,
+# so a retry after a failure skips them. Set CHECKPOINT_FAIL_FAST=1 to re-raise failures.
+CHECKPOINT_DIR = os.getenv("CHECKPOINT_DIR", ".cache")
+CHECKPOINT_FAIL_FAST = os.getenv("CHECKPOINT_FAIL_FAST", "0") == "1"
+CHECKPOINTED_TASKS = ('outline', 'write', 'images')
+
+# CrewAI memory - a fixed storage name keeps the persisted short/long-term
+# memory stores (and their embeddings) across runs, whatever the working directory
+CREW_MEMORY_STORAGE = "storybook_generator"
+os.environ.setdefault("CREWAI_STORAGE_DIR", CREW_MEMORY_STORAGE)
+CREW_EMBEDDER = {
+    "provider": "google",
+    "config": {
+        "model": EMBEDDING_MODEL,
+    }
+}
+
+# Token bucket rate limiting for Gemini API
+class TokenBucket:
+    def __init__(self, capacity=15, refill_per_sec=15 / 60):
         """
-        Initialize rate limiter for Gemini API
+        Initialize token bucket for Gemini API
         
         Args:
-            max_requests_per_minute (int): Maximum requests allowed per minute
-                                         Default is 15 (conservative for free tier)
+            capacity (int): Maximum burst of requests
+                            Default is 15 (conservative for free tier)
+            refill_per_sec (float): Tokens added back per second
+                                    Default is 15 per minute
         """
-        self.max_requests = max_requests_per_minute
-        self.requests = []
+        self.capacity = capacity
+        self.refill_per_sec = refill_per_sec
+        self.tokens = float(capacity)
+        self.last = time.monotonic()
         self.lock = threading.Lock()
         
+    def _refill(self, now):
+        """Add the tokens earned since the last update"""
+        self.tokens = min(self.capacity, self.tokens + (now - self.last) * self.refill_per_sec)
+        self.last = now
+        
+    def acquire(self):
+        """
+        Take a token without blocking
+        
+        Returns:
+            float: 0.0 if a token was taken, otherwise seconds until the next token
+        """
+        with self.lock:
+            self._refill(time.monotonic())
+            if self.tokens >= 1:
+                self.tokens -= 1
+                return 0.0
+            return (1 - self.tokens) / self.refill_per_sec
+        
     def wait_if_needed(self):
-        """Wait if we've exceeded the rate limit"""
+        """Block until a token is available"""
+        wait_seconds = self.acquire()
+        if wait_seconds:
+            logger.info("🕐 Rate limit reached. Waiting %.1f seconds for the next request slot...", wait_seconds)
+        while wait_seconds:
+            time.sleep(wait_seconds)
+            wait_seconds = self.acquire()
+        
+    async def wait_if_needed_async(self):
+        """Wait until a token is available without blocking the event loop"""
+        wait_seconds = self.acquire()
+        if wait_seconds:
+            logger.info("🕐 Rate limit reached. Waiting %.1f seconds for the next request slot...", wait_seconds)
+        while wait_seconds:
+            await asyncio.sleep(wait_seconds)
+            wait_seconds = self.acquire()
+        
+    def in_use(self):
+        """Number of tokens currently consumed"""
         with self.lock:
-            now = datetime.now()
-            # Remove requests older than 1 minute
-            self.requests = [req_time for req_time in self.requests 
-                           if now - req_time < timedelta(minutes=1)]
-            
-            if len(self.requests) >= self.max_requests:
-                # Calculate how long to wait
-                oldest_request = min(self.requests)
-                wait_until = oldest_request + timedelta(minutes=1)
-                wait_seconds = (wait_until - now).total_seconds()
-                
-                if wait_seconds > 0:
-                    print(f"🕐 Rate limit reached. Waiting {wait_seconds:.1f} seconds until next minute...")
-                    time.sleep(wait_seconds + 1)  # Add 1 second buffer
-                    
-                    # Clean up old requests after waiting
-                    now = datetime.now()
-                    self.requests = [req_time for req_time in self.requests 
-                                   if now - req_time < timedelta(minutes=1)]
-            
-            # Record this request
-            self.requests.append(now)
+            self._refill(time.monotonic())
+            return int(self.capacity - self.tokens)
 
 # Global rate limiter instance
-rate_limiter = RateLimiter(max_requests_per_minute=15)  # Conservative limit
+rate_limiter = TokenBucket(capacity=15, refill_per_sec=15 / 60)  # Conservative limit
+
+# Set while a call already holds a token taken asynchronously in ainvoke
+_rate_limit_prepaid = contextvars.ContextVar('rate_limit_prepaid', default=False)
 
 class RateLimitCallback(BaseCallbackHandler):
     """Callback to handle rate limiting before each LLM call"""
     
     def on_llm_start(self, serialized, prompts, **kwargs):
         """Called before each LLM request"""
+        if _rate_limit_prepaid.get():
+            return
         rate_limiter.wait_if_needed()
 
-# Create LLM with proper configuration and rate limiting
-def create_llm():
-    """Create LLM with proper retry configuration and rate limiting"""
+# Global response cache instance
+response_cache = LLMResponseCache(LLM_CACHE_PATH, ttl_seconds=LLM_CACHE_TTL_SECONDS) if LLM_CACHE_ENABLED else None
+
+def create_semantic_cache(prompt_version=0):
+    """Create the semantic cache if enabled and its dependencies are installed"""
+    if not LLM_SEMANTIC_CACHE_ENABLED:
+        return None
     
-    return ChatGoogleGenerativeAI(
-        model="gemini-2.0-flash-exp",
-        temperature=0.7,
-        google_api_key=GOOGLE_API_KEY,
-        max_retries=3,
-        request_timeout=60,
-        callbacks=[RateLimitCallback()],
-        max_output_tokens=2048,
-        top_p=0.9,
-        top_k=40
-    )
+    try:
+        from langchain_google_genai import GoogleGenerativeAIEmbeddings
+        embeddings = GoogleGenerativeAIEmbeddings(model=EMBEDDING_MODEL, google_api_key=GOOGLE_API_KEY, transport=GEMINI_TRANSPORT)
+        return SemanticCache(
+            SEMANTIC_CACHE_PATH,
+            embed_fn=embeddings.embed_query,
+            threshold=LLM_SEMANTIC_THRESHOLD,
+            ttl_seconds=LLM_CACHE_TTL_SECONDS,
+            version=text_version(str(LLM_CACHE_VERSION), str(prompt_version))
+        )
+    except ImportError:
+        print("⚠️  Semantic cache disabled: install faiss-cpu to enable it")
+        return None
+
+# Global semantic cache instance, created by use_prompt_version once the prompts are known
+semantic_cache = None
+
+# Version of the agent and task prompt templates in use (see use_prompt_version)
+prompt_templates_version = 0
+
+def use_prompt_version(version):
+    """
+    Key the response caches on a version of the prompt templates. Semantic hits survive
+    small prompt differences, so without it they would outlive edits to the templates
+    or the style guide; responses cached under other templates are not served.
+    """
+    global semantic_cache, prompt_templates_version
+    prompt_templates_version = version
+    semantic_cache = create_semantic_cache(version)
 
-# Enhanced LLM wrapper that delegates to the underlying LLM
-class GeminiLLMWrapper:
+# Retry policy for GeminiLLMWrapper calls
+LLM_MAX_RETRIES = 5
+LLM_BASE_DELAY = 30  # Base delay in seconds
+
+# Stop calling Gemini a little before the free tier's 1500 requests/day
+GEMINI_DAILY_SOFT_LIMIT = int(os.getenv("GEMINI_DAILY_SOFT_LIMIT", "1450"))
+
+class QuotaExceededError(Exception):
+    """Raised when the daily request soft limit is reached and the prompt is not cached"""
+
+# Matches the retry delay Gemini reports in 429 errors, e.g. "retry_delay { seconds: 42 }"
+_RETRY_DELAY_RE = re.compile(r'seconds:\s*(\d+)', re.I)
+
+# Consecutive failure tracking for backoff between LLM calls
+class BackoffState:
+    __slots__ = ('consecutive_failures', 'last_failure_time')
+    
     def __init__(self):
-        self.llm = create_llm()
         self.consecutive_failures = 0
         self.last_failure_time = None
-        
+
+# Global backoff state
+backoff_state = BackoffState()
+
+# Gemini chat model with response caching, retries and backoff
+class GeminiLLMWrapper(ChatGoogleGenerativeAI):
     def __call__(self, *args, **kwargs):
         return self.invoke(*args, **kwargs)
     
-    def __getattr__(self, name):
-        """Delegate attribute access to the underlying LLM"""
-        return getattr(self.llm, name)
+    def _prompt_messages(self, input):
+        """Return the prompt as a list of (role, content) pairs"""
+        return [(m.type, m.content) for m in self._convert_input(input).to_messages()]
+    
+    def _cache_key(self, messages, **kwargs):
+        """Build the response cache key from the sampling parameters and prompt messages"""
+        return LLMResponseCache.make_key(
+            LLM_CACHE_VERSION,
+            prompt_templates_version,
+            GEMINI_MODEL,
+            GEMINI_TEMPERATURE,
+            GEMINI_TOP_P,
+            GEMINI_TOP_K,
+            GEMINI_MAX_OUTPUT_TOKENS,
+            messages,
+            kwargs.get('stop')
+        )
+    
+    def _lookup_cache(self, input, **kwargs):
+        """
+        Look the prompt up in the response caches
+        
+        Returns:
+            tuple: (cached response or None, exact cache key, semantic embedding)
+        """
+        cache_key = None
+        semantic_vec = None
+        if response_cache is None and semantic_cache is None:
+            return None, cache_key, semantic_vec
+        
+        messages = self._prompt_messages(input)
+        
+        if response_cache is not None:
+            cache_key = self._cache_key(messages, **kwargs)
+            cached = response_cache.get(cache_key)
+            if cached is not None:
+                return cached, cache_key, semantic_vec
+        
+        # Fall back to the closest previously answered prompt
+        if semantic_cache is not None:
+            prompt_text = "\n".join(f"{role}: {content}" for role, content in messages)
+            cached, semantic_vec = semantic_cache.lookup(prompt_text)
+            if cached is not None:
+                return cached, cache_key, semantic_vec
+        
+        return None, cache_key, semantic_vec
     
-    def invoke(self, *args, **kwargs):
+    def _on_success(self, result, cache_key, semantic_vec):
+        """Store a fresh response and reset the failure counter"""
+        if cache_key is not None:
+            response_cache.set(cache_key, result)
+        if semantic_vec is not None:
+            semantic_cache.add(semantic_vec, result)
+        
+        backoff_state.consecutive_failures = 0
+        backoff_state.last_failure_time = None
+    
+    def _start_request(self):
+        """Count an API request, failing fast once the daily soft limit is reached"""
+        # Check and count under one lock, the write and image tasks call this concurrently
+        with usage_tracker.lock:
+            usage_tracker.refresh()
+            if usage_tracker.requests_today >= GEMINI_DAILY_SOFT_LIMIT:
+                raise QuotaExceededError(
+                    f"Daily Gemini soft limit reached ({usage_tracker.requests_today}/{GEMINI_DAILY_SOFT_LIMIT} requests); "
+                    "only cached responses can be served until the quota resets"
+                )
+            usage_tracker.track_request()
+    
+    def _failure_backoff(self):
+        """Seconds to wait before the next call because of previous failures"""
+        if backoff_state.consecutive_failures > 0 and backoff_state.last_failure_time:
+            time_since_failure = time.time() - backoff_state.last_failure_time
+            # Wait longer after consecutive failures
+            required_wait = LLM_BASE_DELAY * (2 ** (backoff_state.consecutive_failures - 1))
+            
+            if time_since_failure < required_wait:
+                wait_time = required_wait - time_since_failure
+                logger.warning("⏳ Waiting %.1f seconds due to previous failures...", wait_time)
+                return wait_time
+        return 0
+    
+    def _retry_delay(self, error, attempt):
+        """
+        Decide whether a failed call should be retried
+        
+        Returns:
+            float: Seconds to wait before the next attempt, or None to re-raise
+        """
+        error_msg = str(error).lower()
+        
+        if "429" in error_msg or "quota" in error_msg or "rate" in error_msg:
+            backoff_state.consecutive_failures += 1
+            backoff_state.last_failure_time = time.time()
+            
+            # Extract retry delay from error message if available
+            retry_delay = 60  # Default 1 minute
+            delay_match = _RETRY_DELAY_RE.search(error_msg)
+            if delay_match:
+                retry_delay = int(delay_match.group(1))
+            
+            wait_time = max(retry_delay, LLM_BASE_DELAY * (2 ** (attempt)))
+            
+            if attempt < LLM_MAX_RETRIES - 1:
+                logger.warning(
+                    "🚫 Rate limit exceeded (attempt %d/%d), waiting %s seconds before retry...",
+                    attempt + 1, LLM_MAX_RETRIES, wait_time
+                )
+                return wait_time
+            
+            logger.error("❌ Max retries exceeded. Please check your API quota and billing.")
+            return None
+        
+        elif "timeout" in error_msg:
+            if attempt < LLM_MAX_RETRIES - 1:
+                wait_time = 10 * (attempt + 1)
+                logger.warning("⏳ Timeout error. Waiting %s seconds before retry...", wait_time)
+                return wait_time
+            return None
+        
+        # For other errors, re-raise immediately
+        return None
+    
+    def invoke(self, input, config=None, **kwargs):
         """Invoke with enhanced error handling and backoff"""
-        max_retries = 5
-        base_delay = 30  # Base delay in seconds
+        # Serve repeated prompts from the response cache without touching the API
+        cached, cache_key, semantic_vec = self._lookup_cache(input, **kwargs)
+        if cached is not None:
+            return cached
         
-        for attempt in range(max_retries):
+        for attempt in range(LLM_MAX_RETRIES):
+            self._start_request()
             try:
                 # Check if we need to wait due to previous failures
-                if self.consecutive_failures > 0 and self.last_failure_time:
-                    time_since_failure = time.time() - self.last_failure_time
-                    # Wait longer after consecutive failures
-                    required_wait = base_delay * (2 ** (self.consecutive_failures - 1))
-                    
-                    if time_since_failure < required_wait:
-                        wait_time = required_wait - time_since_failure
-                        print(f"⏳ Waiting {wait_time:.1f} seconds due to previous failures...")
-                        time.sleep(wait_time)
-                
-                # Apply rate limiting
-                rate_limiter.wait_if_needed()
-                
-                # Make the actual call
-                result = self.llm.invoke(*args, **kwargs)
-                
-                # Reset failure counter on success
-                self.consecutive_failures = 0
-                self.last_failure_time = None
+                wait_time = self._failure_backoff()
+                if wait_time:
+                    time.sleep(wait_time)
                 
+                # Make the actual call (rate limited by RateLimitCallback)
+                result = super().invoke(input, config, **kwargs)
+                self._on_success(result, cache_key, semantic_vec)
                 return result
                 
             except Exception as e:
-                error_msg = str(e).lower()
+                wait_time = self._retry_delay(e, attempt)
+                if wait_time is None:
+                    raise
+                time.sleep(wait_time)
+        
+        raise Exception("Max retries exceeded for LLM calls")
+    
+    async def ainvoke(self, input, config=None, **kwargs):
+        """Async invoke: rate limit and backoff waits yield to the event loop"""
+        cached, cache_key, semantic_vec = self._lookup_cache(input, **kwargs)
+        if cached is not None:
+            return cached
+        
+        for attempt in range(LLM_MAX_RETRIES):
+            self._start_request()
+            try:
+                wait_time = self._failure_backoff()
+                if wait_time:
+                    await asyncio.sleep(wait_time)
                 
-                if "429" in error_msg or "quota" in error_msg or "rate" in error_msg:
-                    self.consecutive_failures += 1
-                    self.last_failure_time = time.time()
-                    
-                    # Extract retry delay from error message if available
-                    retry_delay = 60  # Default 1 minute
-                    if "retry_delay" in error_msg:
-                        try:
-                            # Try to extract the retry delay from the error
-                            import re
-                            delay_match = re.search(r'seconds: (\d+)', error_msg)
-                            if delay_match:
-                                retry_delay = int(delay_match.group(1))
-                        except:
-                            pass
-                    
-                    wait_time = max(retry_delay, base_delay * (2 ** (attempt)))
-                    
-                    if attempt < max_retries - 1:
-                        print(f"🚫 Rate limit exceeded (attempt {attempt + 1}/{max_retries})")
-                        print(f"⏳ Waiting {wait_time} seconds before retry...")
-                        time.sleep(wait_time)
-                        continue
-                    else:
-                        print(f"❌ Max retries exceeded. Please check your API quota and billing.")
-                        raise
+                # Take the rate limit token here so RateLimitCallback does not block a thread
+                await rate_limiter.wait_if_needed_async()
+                token = _rate_limit_prepaid.set(True)
+                try:
+                    result = await super().ainvoke(input, config, **kwargs)
+                finally:
+                    _rate_limit_prepaid.reset(token)
                 
-                elif "timeout" in error_msg:
-                    if attempt < max_retries - 1:
-                        wait_time = 10 * (attempt + 1)
-                        print(f"⏳ Timeout error. Waiting {wait_time} seconds before retry...")
-                        time.sleep(wait_time)
-                        continue
-                    else:
-                        raise
+                self._on_success(result, cache_key, semantic_vec)
+                return result
                 
-                else:
-                    # For other errors, re-raise immediately
+            except Exception as e:
+                wait_time = self._retry_delay(e, attempt)
+                if wait_time is None:
                     raise
+                await asyncio.sleep(wait_time)
         
         raise Exception("Max retries exceeded for LLM calls")
+    
+    # CrewAI agents call the model through stream (RunnableAgent.plan -> stream ->
+    # BaseChatModel.stream), never invoke. Route those calls through invoke so they get
+    # the caches, the soft limit and the retries; the reply arrives as a single chunk,
+    # as BaseChatModel.stream does for models without streaming support
+    def stream(self, input, config=None, *, stop=None, **kwargs):
+        """Stream via invoke: cached, counted and retried like every other call"""
+        yield self.invoke(input, config, stop=stop, **kwargs)
+    
+    async def astream(self, input, config=None, *, stop=None, **kwargs):
+        """Async stream via ainvoke"""
+        yield await self.ainvoke(input, config, stop=stop, **kwargs)
+
+# Create LLM with proper configuration and rate limiting
+def create_llm():
+    """Create LLM with proper retry configuration and rate limiting"""
+    
+    return GeminiLLMWrapper(
+        model=GEMINI_MODEL,
+        temperature=GEMINI_TEMPERATURE,
+        google_api_key=GOOGLE_API_KEY,
+        max_retries=3,
+        request_timeout=60,
+        callbacks=[RateLimitCallback()],
+        max_output_tokens=GEMINI_MAX_OUTPUT_TOKENS,
+        top_p=GEMINI_TOP_P,
+        top_k=GEMINI_TOP_K,
+        transport=GEMINI_TRANSPORT
+    )
 
-# Create the LLM instance
-llm = GeminiLLMWrapper()
+# Create the LLM instance. Every agent is handed this one object, so all Gemini calls
+# share its client and its single multiplexed HTTP/2 channel; don't create per-agent LLMs
+llm = create_llm()
 
 # Hugging Face API Configuration
 HF_API_URL = "https://api-inference.huggingface.co/models/black-forest-labs/FLUX.1-dev"
 HF_HEADERS = {"Authorization": f"Bearer {HUGGINGFACE_API_KEY}"}
+HF_MAX_CONCURRENT_REQUESTS = 5  # One in-flight FLUX request per chapter
+FLUX_CACHE_DIR = ".flux_cache"  # Generated images, keyed on a hash of the model and request payload
+
+# Shared HTTP session so FLUX requests reuse pooled keep-alive connections
+HF_SESSION = requests.Session()
+HF_SESSION.headers.update(HF_HEADERS)
+HF_SESSION.mount("https://", HTTPAdapter(
+    pool_connections=8,
+    pool_maxsize=16,
+    max_retries=Retry(
+        total=5,
+        backoff_factor=2.0,
+        status_forcelist=[429, 502, 503, 504],  # Rate limited, or the model is still loading
+        allowed_methods=None,  # Also retry POST, the inference call is idempotent
+        respect_retry_after_header=True,
+        raise_on_status=False
+    )
+))
 
 # File paths
-TEMPLATE_FILE = "template.md"
+PDF_CONVERSION_TIMEOUT = int(os.getenv("PDF_CONVERSION_TIMEOUT", "120"))  # seconds, for the whole PDF race
 OUTPUT_MARKDOWN = "story.md"
 
+# Finished storybook cache - a repeated topic is served from disk. Set STORYBOOK_CACHE=0
+# to always generate a new book. Changing a model, the prompts or LLM_CACHE_VERSION invalidates it.
+STORYBOOK_CACHE_ENABLED = os.getenv("STORYBOOK_CACHE", "1") == "1"
+STORYBOOK_CACHE_DIR = os.path.join(CHECKPOINT_DIR, "books")
+STORYBOOK_CACHE_TTL_SECONDS = 7 * 86400  # News-like topics get 1 hour, classic themes 30 days
+STORYBOOK_CACHE_MAX_ENTRIES = 200
+STORYBOOK_CACHE_FINGERPRINT = {
+    'model': GEMINI_MODEL,
+    'image_model': HF_API_URL,
+    'cache_version': LLM_CACHE_VERSION
+}
+
 # Logging configuration for better debugging
 logging.basicConfig(
     level=logging.INFO,
@@ -184,42 +461,60 @@ logging.basicConfig(
 
 # API Usage tracking
 class APIUsageTracker:
+    __slots__ = ('requests_today', '_next_rollover', 'lock')
+    
     def __init__(self):
         self.requests_today = 0
-        self.last_reset = datetime.now().date()
+        self._next_rollover = self._midnight_after(time.time())
+        self.lock = threading.RLock()
+        
+    @staticmethod
+    def _midnight_after(timestamp):
+        """Epoch timestamp of the next local midnight"""
+        tomorrow = datetime.fromtimestamp(timestamp).date() + timedelta(days=1)
+        return datetime.combine(tomorrow, datetime.min.time()).timestamp()
+        
+    def refresh(self, now=None):
+        """Reset the daily count once local midnight has passed"""
+        now = time.time() if now is None else now
+        with self.lock:
+            if now >= self._next_rollover:
+                self.requests_today = 0
+                self._next_rollover = self._midnight_after(now)
         
     def track_request(self):
         """Track API request usage"""
-        today = datetime.now().date()
-        if today != self.last_reset:
-            self.requests_today = 0
-            self.last_reset = today
-        
-        self.requests_today += 1
+        with self.lock:
+            self.refresh()
+            self.requests_today += 1
+            requests_today = self.requests_today
         
         # Warn if approaching daily limits (assuming 1500 requests/day for free tier)
-        if self.requests_today > 1200:
-            print(f"⚠️  High API usage today: {self.requests_today} requests")
+        if requests_today > 1200:
+            print(f"⚠️  High API usage today: {requests_today} requests")
         
-        return self.requests_today
+        return requests_today
 
 # Global usage tracker
 usage_tracker = APIUsageTracker()
 
 def get_api_status():
     """Get current API usage status"""
+    usage_tracker.refresh()
     return {
         'requests_today': usage_tracker.requests_today,
-        'rate_limit_requests': len(rate_limiter.requests),
-        'max_requests_per_minute': rate_limiter.max_requests
+        'rate_limit_requests': rate_limiter.in_use(),
+        'max_requests_per_minute': rate_limiter.capacity
     }
 
 def print_api_status():
     """Print current API usage status"""
     status = get_api_status()
-    print(f"📊 API Status:")
-    print(f"   Daily requests: {status['requests_today']}")
-    print(f"   Current minute: {status['rate_limit_requests']}/{status['max_requests_per_minute']}")
+    print(
+        f"📊 API Status:\n"
+        f"   Daily requests: {status['requests_today']}\n"
+        f"   Current minute: {status['rate_limit_requests']}/{status['max_requests_per_minute']}"
+    )
 
 # Configuration validation
 def validate_config():
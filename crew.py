@@ -1,54 +1,97 @@
+import os
+import shutil
+import threading
+from concurrent.futures import Future
 from crewai import Crew, Process
 from agents import (
     create_story_outliner,
     create_story_writer, 
     create_image_generator,
-    create_content_formatter,
-    create_markdown_to_pdf_creator
+    create_markdown_to_pdf_creator,
+    StorybookAgents,
+    AGENT_PROMPTS
 )
-from tasks import create_tasks
+from tasks import create_tasks, TASK_PROMPTS
+from tools import warm_pdf_tools
+from cache import TaskCheckpoints, StorybookCache, topic_key, text_version
+from config import (
+    use_prompt_version, CREW_EMBEDDER, CHECKPOINT_DIR, CHECKPOINT_FAIL_FAST, OUTPUT_MARKDOWN,
+    STORYBOOK_CACHE_ENABLED, STORYBOOK_CACHE_DIR, STORYBOOK_CACHE_TTL_SECONDS, STORYBOOK_CACHE_FINGERPRINT,
+    STORYBOOK_CACHE_MAX_ENTRIES
+)
+
+# Output files of a finished run, as kept by the storybook cache
+OUTPUT_FILES = tuple(os.path.splitext(OUTPUT_MARKDOWN)[0] + ext for ext in ('.md', '.html', '.pdf'))
+OUTPUT_PDF = OUTPUT_FILES[-1]
+
+# Version of every agent and task prompt: responses and storybooks cached under
+# other prompts are not reused, so prompt edits invalidate them automatically
+PROMPT_VERSION = text_version(*AGENT_PROMPTS, *TASK_PROMPTS)
+use_prompt_version(PROMPT_VERSION)
+
+storybook_cache = StorybookCache(
+    STORYBOOK_CACHE_DIR,
+    ttl_seconds=STORYBOOK_CACHE_TTL_SECONDS,
+    fingerprint=dict(STORYBOOK_CACHE_FINGERPRINT, prompt_version=PROMPT_VERSION),
+    max_entries=STORYBOOK_CACHE_MAX_ENTRIES,
+    required_files=(os.path.basename(OUTPUT_PDF),)  # Only complete books, never an HTML-only fallback
+) if STORYBOOK_CACHE_ENABLED else None
 
-def create_storybook_crew(topic: str):
+def _remove_outputs():
+    """Remove the output files of an earlier run, so only this run's files are cached."""
+    for path in OUTPUT_FILES:
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+
+def create_storybook_crew(topic: str, checkpoints: TaskCheckpoints = None):
     """
     Creates and returns the CrewAI crew for generating children's storybooks.
     
     Args:
         topic (str): The story topic chosen by the user
+        checkpoints (TaskCheckpoints): Optional checkpoints of an earlier failed run to resume
         
     Returns:
         Crew: Configured crew with all agents and tasks
     """
-    # Create agents with the specified topic
-    agents = {
-        'story_outliner': create_story_outliner(topic),
-        'story_writer': create_story_writer(topic),
-        'image_generator': create_image_generator(),
-        'content_formatter': create_content_formatter(),
-        'markdown_to_pdf_creator': create_markdown_to_pdf_creator()
-    }
+    # Create agents with the specified topic, in pipeline order
+    agents = StorybookAgents(
+        create_story_outliner(topic),
+        create_story_writer(topic),
+        create_image_generator(),
+        create_markdown_to_pdf_creator()
+    )
     
     # Create tasks with the specified topic and agents
-    tasks = create_tasks(topic, agents)
+    tasks = create_tasks(topic, agents, checkpoints)
     
     crew = Crew(
-        agents=list(agents.values()),
+        agents=list(agents),
         tasks=tasks,
         verbose=True,
         process=Process.sequential,
         memory=True,
-        embedder={
-            "provider": "google",
-            "config": {
-                "model": "models/embedding-001",
-            }
-        }
+        embedder=CREW_EMBEDDER
     )
     
     return crew
 
+# Runs in progress, keyed on the normalized topic, so concurrent requests for the
+# same topic wait for one pipeline instead of each running their own
+_inflight = {}
+_inflight_lock = threading.Lock()
+
+# Runs for different topics take turns: they share the cached agents and write the
+# same output files (story.md, story.html, story.pdf) in the working directory
+_generation_lock = threading.Lock()
+
 def run_storybook_generation(topic: str):
     """
-    Executes the storybook generation process.
+    Executes the storybook generation process. A request for a topic that is
+    already being generated waits for that run and shares its result; requests
+    for other topics wait for it to finish before starting their own.
     
     Args:
         topic (str): The story topic chosen by the user
@@ -56,23 +99,77 @@ def run_storybook_generation(topic: str):
     Returns:
         str: Result of the crew execution
     """
+    key = topic_key(topic)
+    with _inflight_lock:
+        future = _inflight.get(key)
+        owner = future is None
+        if owner:
+            future = _inflight[key] = Future()
+    
+    if not owner:
+        print(f"⏳ A storybook about '{topic}' is already being generated, waiting for it...")
+        return future.result()
+    
+    try:
+        with _generation_lock:
+            result = _generate_storybook(topic)
+        future.set_result(result)
+        return result
+    except BaseException as e:
+        future.set_exception(e)
+        raise
+    finally:
+        with _inflight_lock:
+            del _inflight[key]
+
+def _generate_storybook(topic: str):
+    """Run one storybook generation: cache lookup, then the crew."""
     print(f"🚀 Starting Children's Storybook Generation about: {topic}")
     print("=" * 60)
     
-    # Create the crew with the specified topic
-    crew = create_storybook_crew(topic)
+    # Serve a storybook generated earlier for the same topic straight from disk
+    cached = storybook_cache.get(topic) if storybook_cache else None
+    if cached:
+        for path in cached:
+            shutil.copy2(path, os.path.basename(path))
+        print(f"⚡ Storybook about '{topic}' served from cache: {', '.join(map(os.path.basename, cached))}")
+        return f"Served from the storybook cache: {', '.join(map(os.path.basename, cached))}"
+    
+    # The PDF step runs last; probe its tools while the story is generated
+    warm_pdf_tools()
+    
+    # Start from a clean slate: an earlier topic's story.pdf must not be taken for this one.
+    # Done before the crew is built, which may already lay out a resumed run
+    _remove_outputs()
+    
+    # Create the crew with the specified topic, resuming any earlier failed run
+    checkpoints = TaskCheckpoints(CHECKPOINT_DIR, topic)
+    crew = create_storybook_crew(topic, checkpoints)
     
     # Execute the crew
     try:
         result = crew.kickoff()
+        # A missing PDF tool does not raise, the PDF step falls back to HTML; keep the
+        # checkpoints (and skip the cache) until a run actually produces the PDF
+        if os.path.exists(OUTPUT_PDF):
+            checkpoints.clear()
+            if storybook_cache:
+                storybook_cache.put(topic, OUTPUT_FILES)
+        else:
+            print("♻️  No PDF was produced; completed steps stay checkpointed for the next run.")
         print("\n" + "=" * 60)
         print("✅ Storybook generation completed successfully!")
         print(f"📖 Generated storybook about: {topic}")
         print("📁 Check the generated files:")
         print("   - story.md (Markdown version)")
+        print("   - story.html (HTML version)")
         print("   - story.pdf (PDF version)")
         print("   - Generated images in the current directory")
         return result
     except Exception as e:
         print(f"\n❌ Error during storybook generation: {str(e)}")
+        checkpoints.log_failure(e)
+        if CHECKPOINT_FAIL_FAST:
+            raise
+        print("♻️  Completed steps were checkpointed; run the same topic again to resume.")
         return None
\ No newline at end of file
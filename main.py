@@ -91,54 +91,25 @@ def check_system_requirements():
     
     return True
 
-def create_template_file():
-    """Create a basic template file if it doesn't exist."""
-    template_content = """# {Story Title}
-
-## Chapter 1: {Chapter Title}
-![Chapter 1 Image]({image_path})
-
-{Chapter content goes here...}
-
-## Chapter 2: {Chapter Title}
-![Chapter 2 Image]({image_path})
-
-{Chapter content goes here...}
-
-## Chapter 3: {Chapter Title}
-![Chapter 3 Image]({image_path})
-
-{Chapter content goes here...}
-
-## Chapter 4: {Chapter Title}
-![Chapter 4 Image]({image_path})
-
-{Chapter content goes here...}
-
-## Chapter 5: {Chapter Title}
-![Chapter 5 Image]({image_path})
-
-{Chapter content goes here...}
-"""
-    
-    if not os.path.exists("template.md"):
-        with open("template.md", "w") as f:
-            f.write(template_content)
-        print("📝 Created template.md file")
-
 def show_rate_limit_info():
     """Show information about rate limits and usage"""
-    print("\n📊 Rate Limiting Information:")
-    print("   • Gemini API: 15 requests per minute (conservative)")
-    print("   • Automatic retry with exponential backoff")
-    print("   • Intelligent waiting between failed requests")
-    print("   • Progress tracking and status updates")
+    lines = [
+        "\n📊 Rate Limiting Information:",
+        "   • Gemini API: 15 requests per minute (conservative)",
+        "   • Automatic retry with exponential backoff",
+        "   • Intelligent waiting between failed requests",
+        "   • Progress tracking and status updates",
+    ]
     
     status = get_api_status()
     if status['requests_today'] > 0:
-        print(f"\n📈 Today's Usage:")
-        print(f"   • Total requests: {status['requests_today']}")
-        print(f"   • Current minute: {status['rate_limit_requests']}/15")
+        lines += [
+            "\n📈 Today's Usage:",
+            f"   • Total requests: {status['requests_today']}",
+            f"   • Current minute: {status['rate_limit_requests']}/{status['max_requests_per_minute']}",
+        ]
+    
+    print("\n".join(lines))
 
 def handle_quota_exceeded():
     """Handle quota exceeded scenarios"""
@@ -173,9 +144,6 @@ def main():
     if not check_system_requirements():
         sys.exit(1)
     
-    # Create template file if needed
-    create_template_file()
-    
     # Get story topic from user
     topic = get_story_topic()
     
@@ -0,0 +1,109 @@
+from typing import Dict, List
+from pydantic import BaseModel, Field, ValidationError
+
+_NO_PARENS = str.maketrans('', '', '()')
+_ESCAPED_PARENS = str.maketrans({'%': '%25', '(': '%28', ')': '%29'})
+
+def _image_target(image: str) -> str:
+    """
+    Markdown image target for a chapter image: on one line and free of parentheses.
+    Placeholder text just loses them; file paths are percent-encoded so they still resolve.
+    """
+    target = " ".join(image.split())
+    if target.startswith("PLACEHOLDER:"):
+        return target.translate(_NO_PARENS)
+    return target.translate(_ESCAPED_PARENS)
+
+# Structured task outputs, passed to CrewAI as output_pydantic so each task
+# returns JSON in a fixed shape instead of prose the next task has to re-read
+
+class Character(BaseModel):
+    name: str
+    description: str
+    role: str = Field(description="main or supporting, and their part in the story")
+
+class ChapterPlan(BaseModel):
+    number: int
+    title: str
+    summary: str
+    plot_points: List[str]
+
+class Outline(BaseModel):
+    title: str
+    characters: List[Character]
+    chapters: List[ChapterPlan] = Field(description="Exactly 5 chapters, in order")
+    setting: str
+    themes: List[str] = Field(description="Age-appropriate themes and lessons")
+
+class ChapterText(BaseModel):
+    number: int
+    title: str
+    text: str = Field(description="The full chapter text, about 100 words")
+
+class Manuscript(BaseModel):
+    title: str
+    chapters: List[ChapterText] = Field(description="Exactly 5 chapters, in order")
+
+    def to_markdown(self, images: Dict[int, str] = None) -> str:
+        """
+        Render the manuscript as markdown following the story template: one
+        '## Chapter N: Title' section per chapter, with the chapter's image (path or
+        PLACEHOLDER description, keyed by chapter number) at its start.
+        """
+        images = images or {}
+        parts = [f"# {self.title}"]
+        for c in self.chapters:
+            section = f"## Chapter {c.number}: {c.title}\n"
+            if c.number in images:
+                section += f"![Chapter {c.number} Image]({_image_target(images[c.number])})\n"
+            parts.append(section + "\n" + c.text.strip())
+        return "\n\n".join(parts) + "\n"
+
+class ChapterImage(BaseModel):
+    number: int
+    image: str = Field(description="Image file path, or a description starting with 'PLACEHOLDER:'")
+
+class ChapterImages(BaseModel):
+    images: List[ChapterImage] = Field(description="One entry per chapter, in order")
+
+def task_output_model(task_output, model=None):
+    """
+    Return the pydantic model parsed from a CrewAI task output, if there is one.
+    Given the expected model, falls back to parsing the raw output text.
+    """
+    parsed = getattr(task_output, 'pydantic', None)
+    if parsed is None and model is not None:
+        parsed = parse_model(model, task_output_text(task_output))
+    return parsed
+
+def task_output_text(task_output) -> str:
+    """Return the raw text of a CrewAI task output (JSON for structured tasks)."""
+    return (getattr(task_output, 'raw', None) or str(task_output)).strip()
+
+def task_output_json(task_output) -> str:
+    """
+    Return the text to checkpoint for a CrewAI task output: its model as JSON when
+    CrewAI parsed one (raw may be the unconverted answer), otherwise the raw text.
+    """
+    parsed = getattr(task_output, 'pydantic', None)
+    if isinstance(parsed, BaseModel):
+        return parsed.model_dump_json()
+    return task_output_text(task_output)
+
+def snip_task_output(task_output, note: str) -> None:
+    """
+    Replace the raw text of a task output that has been fully consumed and saved
+    with a short note, so tasks that still list it as context get the note instead.
+    """
+    if getattr(task_output, 'raw', None) is not None:
+        task_output.raw = note
+
+def parse_model(model, text: str):
+    """Parse model JSON from an LLM answer, tolerating a ```json fence; None if invalid."""
+    text = text.strip()
+    if text.startswith("```"):
+        text = text.split("\n", 1)[-1].rsplit("```", 1)[0]
+    try:
+        return model.model_validate_json(text)
+    except (ValidationError, ValueError):
+        return None
@@ -1,218 +1,303 @@
+import functools
+import json
+import threading
 from crewai import Task
-from config import OUTPUT_MARKDOWN
+from config import OUTPUT_MARKDOWN, CHECKPOINTED_TASKS
+from models import Outline, Manuscript, ChapterImages, parse_model, snip_task_output, task_output_json, task_output_model
+from tools import save_manuscript_draft, write_manuscript_draft, render_storybook
 
-def create_tasks(topic: str, agents: dict):
+# Static prompt text, shared by every topic
+_OUTLINE_DESCRIPTION = """
+    Create a comprehensive outline for a children's storybook about the story topic given below.
+    The outline should include:
+    - A compelling story title related to the topic
+    - 5 chapter titles that flow logically
+    - Detailed character descriptions (main characters and supporting characters)
+    - Main plot points for each chapter
+    - Setting descriptions appropriate for the topic
+    
+    Follow the style guide in your system prompt and incorporate the topic in meaningful ways.
+    
+    """
+
+_OUTLINE_EXPECTED_OUTPUT = """
+    The outline as an Outline object (see its schema), incorporating the topic.
+    
+    """
+
+_WRITE_DESCRIPTION = """
+    Using the outline provided, write the complete story content for all 5 chapters.
+    Requirements:
+    - Follow the style guide in your system prompt
+    - Include the story title at the top
+    - Ensure cohesive narrative flow between chapters
+    - Incorporate the story topic meaningfully throughout the story
+    - Write in a format that's ready for professional book layout
+    
+    """
+
+_WRITE_EXPECTED_OUTPUT = """
+    The complete story as a Manuscript object (see its schema), with the full text of all 5 chapters.
+    
+    """
+
+_IMAGES_DESCRIPTION = """
+    Generate all 5 chapter images for the children's storybook in parallel, one for each chapter.
+    The story text is being written at the same time, so work from the outline.
+    For each image:
+    - Use the chapter's plan (title, summary, plot points) and the character descriptions
+    - Include detailed location information
+    - Capture the key scene or moment from each chapter
+    - Follow the illustration rules of the style guide in your system prompt
+    - Call the generate_images_batch tool ONCE with all 5 chapter descriptions, in chapter order
+    - Only use the generate_image_flux tool to retry an individual chapter
+    - Incorporate visual elements related to the story topic
+    - Create images that will enhance the story when displayed in PDF format
+    
+    If image generation fails due to quota limits or technical issues:
+    - Provide detailed placeholder descriptions for each chapter
+    - Include character descriptions, setting details, and key visual elements
+    - Make descriptions vivid enough that someone could visualize or draw the scene
+    - Format descriptions as professional image captions
+    
+    Return either the file paths of generated images OR detailed placeholder descriptions.
+    
+    """
+
+_IMAGES_EXPECTED_OUTPUT = """
+    A ChapterImages object (see its schema) with one entry per chapter: the image file path,
+    or a detailed placeholder description starting with "PLACEHOLDER:" if generation failed.
+    
+    """
+
+_PDF_DESCRIPTION = f"""
+    The storybook has already been laid out in {OUTPUT_MARKDOWN}, with the chapter images merged in.
+    Convert it to a high-quality PDF suitable for printing and sharing.
+    
+    Requirements:
+    - Call the convert_markdown_to_pdf tool once with the file name {OUTPUT_MARKDOWN}
+    - The tool runs every available method at once (WeasyPrint, mdpdf, wkhtmltopdf)
+      and keeps the first complete PDF
+    - Provide detailed feedback on conversion success
+    - If conversion fails, provide specific installation instructions
+    """
+
+_PDF_EXPECTED_OUTPUT = """
+    Either:
+    - A high-quality PDF file path (if conversion succeeds) with:
+      * Professional book layout and typography
+      * Properly embedded and sized images
+      * Consistent formatting throughout
+      * Print-ready quality suitable for publication
+      * Optimized file size for sharing
+    
+    OR (if conversion fails):
+    - Clear error message with specific tool installation instructions
+    - Confirmation that the HTML file was created successfully
+    - Alternative conversion methods and online tools
+    - Detailed troubleshooting steps
+    
+    The PDF should be indistinguishable from a professionally published children's book,
+    suitable for printing, sharing, or commercial use.
+    """
+
+# Context the PDF task gets in place of the manuscript once it has been laid out
+_MANUSCRIPT_NOTE = f"The complete manuscript has been laid out in {OUTPUT_MARKDOWN}."
+
+# Task graph: each task and the tasks whose output it needs, listed in topological
+# order. Tasks at the same depth have no path between them, so they run concurrently
+# (async_execution); the next deeper task waits for all of them.
+TASK_GRAPH = {
+    'outline': (),
+    'write': ('outline',),
+    'images': ('outline',),
+    'pdf': ('write', 'images'),
+}
+
+def _task_depths(graph):
+    """Return each task's depth in the graph, checking that it is in topological order."""
+    depths = {}
+    for kind, upstream in graph.items():
+        missing = [u for u in upstream if u not in depths]
+        if missing:
+            raise ValueError(f"Task '{kind}' is listed before its upstream tasks {missing}")
+        depths[kind] = 1 + max((depths[u] for u in upstream), default=-1)
+    return depths
+
+_TASK_DEPTHS = _task_depths(TASK_GRAPH)
+_CONCURRENT_TASKS = frozenset(
+    kind for kind, depth in _TASK_DEPTHS.items()
+    if sum(d == depth for d in _TASK_DEPTHS.values()) > 1
+)
+
+# Trailing line appended to the prompts that depend on the topic
+_TOPIC_LINE = "Story topic: {topic}\n    "
+
+# Every piece of task prompt text, including the output schemas CrewAI shows the
+# agents; hashed into the cache version (see crew.py)
+TASK_PROMPTS = (
+    _OUTLINE_DESCRIPTION, _OUTLINE_EXPECTED_OUTPUT,
+    _WRITE_DESCRIPTION, _WRITE_EXPECTED_OUTPUT,
+    _IMAGES_DESCRIPTION, _IMAGES_EXPECTED_OUTPUT,
+    _PDF_DESCRIPTION, _PDF_EXPECTED_OUTPUT,
+    _MANUSCRIPT_NOTE, _TOPIC_LINE
+) + tuple(json.dumps(model.model_json_schema(), sort_keys=True) for model in (Outline, Manuscript, ChapterImages))
+
+# Prompt text for each task kind, built once per topic
+@functools.lru_cache(maxsize=32)
+def _task_prompts(topic: str):
+    """Return the description and expected output of every task for a topic."""
+    topic_line = _TOPIC_LINE.format(topic=topic)
+    return {
+        'outline': dict(
+            description=_OUTLINE_DESCRIPTION + topic_line,
+            expected_output=_OUTLINE_EXPECTED_OUTPUT + topic_line
+        ),
+        'write': dict(
+            description=_WRITE_DESCRIPTION + topic_line,
+            expected_output=_WRITE_EXPECTED_OUTPUT + topic_line
+        ),
+        'images': dict(
+            description=_IMAGES_DESCRIPTION + topic_line,
+            expected_output=_IMAGES_EXPECTED_OUTPUT + topic_line
+        ),
+        'pdf': dict(
+            description=_PDF_DESCRIPTION,
+            expected_output=_PDF_EXPECTED_OUTPUT
+        )
+    }
+
+def _with_upstream(prompt, tasks, saved, kinds):
+    """
+    Resolve a task's upstream tasks into live context tasks, appending the output
+    of any upstream task restored from a checkpoint to the prompt instead.
+    """
+    context = [tasks[kind] for kind in kinds if kind in tasks]
+    restored = "".join(
+        f"\n    Output of the {kind} step from an earlier run:\n{saved[kind]}\n    "
+        for kind in kinds if kind in saved
+    )
+    if restored:
+        prompt = dict(prompt, description=prompt['description'] + restored)
+    return prompt, context
+
+def _storybook_layout(saved):
+    """
+    Build the layout step for the manuscript and image tasks, which run concurrently.
+    Returns a function that gives the task callback for one of them; whichever task
+    finishes last lays out the storybook. Tasks restored from checkpoints count as finished.
+    """
+    lock = threading.Lock()
+    finished = {kind: None for kind in ('write', 'images') if kind in saved}
+
+    def result(model, kind):
+        output = finished[kind]
+        if output is None:
+            return parse_model(model, saved[kind])
+        return task_output_model(output, model)
+
+    def render():
+        manuscript = result(Manuscript, 'write')
+        if manuscript is None and finished['write'] is None:
+            # A restored manuscript that does not parse: its text is the draft to lay out
+            write_manuscript_draft(saved['write'].strip() + "\n")
+        render_storybook(manuscript, result(ChapterImages, 'images'))
+        # The PDF task lists the manuscript as context only to wait for it; once the
+        # manuscript is laid out and checkpointed, pass a one-line note instead of the full text
+        if finished['write'] is not None:
+            snip_task_output(finished['write'], _MANUSCRIPT_NOTE)
+
+    def on_finished(kind, then=None):
+        def _callback(task_output):
+            if then is not None:
+                then(task_output)
+            with lock:
+                finished[kind] = task_output
+                if len(finished) < 2:
+                    return
+            render()
+        return _callback
+
+    if len(finished) == 2:
+        render()
+    return on_finished
+
+def _complete_images_json(task_output):
+    """Checkpoint text of the image task, or None while a chapter has only a placeholder, so a resumed run retries the images."""
+    images = task_output_model(task_output, ChapterImages)
+    if images is None or any(i.image.startswith("PLACEHOLDER:") for i in images.images):
+        return None
+    return images.model_dump_json()
+
+def create_tasks(topic: str, agents, checkpoints=None):
     """
     Create all tasks with the specified topic and agents.
     
     Args:
         topic (str): The story topic chosen by the user
-        agents (dict): Dictionary containing all the agent instances
+        agents (StorybookAgents): The agent instances
+        checkpoints (TaskCheckpoints): Optional store of task outputs from an
+                                       earlier failed run; completed tasks are skipped
         
     Returns:
         list: List of task instances
     """
+    story_outliner, story_writer, image_generator, markdown_to_pdf_creator = agents
+    prompts = _task_prompts(topic)
+    saved = checkpoints.load(CHECKPOINTED_TASKS) if checkpoints else {}
+    tasks = {}
+
+    def checkpointed(kind, then=None, to_text=task_output_json):
+        return checkpoints.callback(kind, then, to_text=to_text) if checkpoints else then
+
+    if saved:
+        print(f"♻️  Resuming from checkpoints: {', '.join(saved)}")
 
     # Task 1: Create Story Outline
-    task_outline = Task(
-        description=f"""
-        Create a comprehensive outline for a children's storybook about {topic}. 
-        The outline should include:
-        - A compelling story title related to {topic}
-        - 5 chapter titles that flow logically
-        - Detailed character descriptions (main characters and supporting characters)
-        - Main plot points for each chapter
-        - Setting descriptions appropriate for {topic}
-        - Age-appropriate themes and lessons
-        
-        Make sure the story is engaging for children aged 4-8 years old and incorporates {topic} in meaningful ways.
-        """,
-        agent=agents['story_outliner'],
-        expected_output=f"""
-        A structured outline document containing:
-        1. Story title related to {topic}
-        2. Character profiles with names, descriptions, and roles
-        3. 5 chapter titles with brief summaries
-        4. Main plot points and story arc incorporating {topic}
-        5. Setting descriptions
-        6. Themes and educational value related to {topic}
-        """
-    )
+    if 'outline' not in saved:
+        tasks['outline'] = Task(
+            **prompts['outline'],
+            agent=story_outliner,
+            output_pydantic=Outline,
+            async_execution='outline' in _CONCURRENT_TASKS,
+            callback=checkpointed('outline')
+        )
 
-    # Task 2: Write Full Story
-    task_write = Task(
-        description=f"""
-        Using the outline provided, write the complete story content for all 5 chapters about {topic}.
-        Requirements:
-        - Each chapter should be approximately 100 words
-        - Include the story title at the top
-        - Ensure cohesive narrative flow between chapters
-        - Use age-appropriate language and vocabulary
-        - Include dialogue and descriptive elements
-        - Maintain consistent character voices
-        - Ensure each chapter has a clear beginning, middle, and conclusion
-        - Incorporate {topic} meaningfully throughout the story
-        - Write in a format that's ready for professional book layout
-        """,
-        agent=agents['story_writer'],
-        expected_output=f"""
-        A complete manuscript of the children's storybook about {topic} with:
-        - Story title
-        - 5 chapters, each approximately 100 words
-        - Engaging dialogue and narration
-        - Consistent character development
-        - Clear story progression and resolution
-        - Meaningful incorporation of {topic}
-        - Professional formatting suitable for immediate PDF conversion
-        """,
-        context=[task_outline]
-    )
+    # Tasks 2 and 3 both need only the outline, so the story is written while the
+    # chapter images are generated; the storybook is laid out when both are done
+    layout = _storybook_layout(saved)
 
-    # Task 3: Generate Images
-    task_image_generate = Task(
-        description=f"""
-        Generate 5 high-quality images for the children's storybook about {topic}, one for each chapter.
-        For each image:
-        - Use the chapter content and character details
-        - Include detailed location information
-        - Capture the key scene or moment from each chapter
-        - Ensure images are child-friendly and engaging
-        - Maintain consistent artistic style across all images
-        - Generate images sequentially, one by one
-        - Incorporate visual elements related to {topic}
-        - Create images that will enhance the story when displayed in PDF format
-        
-        If image generation fails due to quota limits or technical issues:
-        - Provide detailed placeholder descriptions for each chapter
-        - Include character descriptions, setting details, and key visual elements
-        - Make descriptions vivid enough that someone could visualize or draw the scene
-        - Format descriptions as professional image captions
-        
-        Return either the file paths of generated images OR detailed placeholder descriptions.
-        """,
-        agent=agents['image_generator'],
-        expected_output=f"""
-        For each of the 5 chapters, either:
-        - A valid image file path (if generation succeeds), OR
-        - A detailed placeholder description starting with "PLACEHOLDER:" (if generation fails)
-        
-        Format:
-        - Chapter 1: [image_path or detailed description]
-        - Chapter 2: [image_path or detailed description]  
-        - Chapter 3: [image_path or detailed description]
-        - Chapter 4: [image_path or detailed description]
-        - Chapter 5: [image_path or detailed description]
-        
-        Each should visually represent or describe the key elements of its respective chapter and incorporate {topic}.
-        Images should be optimized for PDF display with proper resolution and formatting.
-        """,
-        context=[task_outline, task_write]
-    )
+    # Task 2: Write Full Story
+    if 'write' not in saved:
+        prompt, context = _with_upstream(prompts['write'], tasks, saved, TASK_GRAPH['write'])
+        tasks['write'] = Task(
+            **prompt,
+            agent=story_writer,
+            context=context,
+            output_pydantic=Manuscript,
+            async_execution='write' in _CONCURRENT_TASKS,
+            callback=checkpointed('write', layout('write', save_manuscript_draft))
+        )
 
-    # Task 4: Format Content for Professional PDF
-    task_format_content = Task(
-        description=f"""
-        Format the complete story content in a professional book layout suitable for high-quality PDF generation.
-        
-        Requirements:
-        - Create a properly structured HTML document with embedded CSS for professional formatting
-        - Include the story title as an elegant main header with decorative elements
-        - Format each chapter with:
-          * Professional chapter headings with consistent styling
-          * Proper image placement (either actual images or styled placeholder descriptions)
-          * Well-formatted text with appropriate line spacing and typography
-          * Page break considerations for optimal reading flow
-        - Use professional typography with:
-          * Serif fonts for body text (Georgia, Times New Roman)
-          * Sans-serif fonts for headings
-          * Proper font sizes and spacing
-          * Justified text alignment
-        - Include CSS for:
-          * Professional color scheme
-          * Proper margins and padding
-          * Print-ready formatting
-          * Image styling and placement
-          * Chapter break handling
-        - Handle images gracefully:
-          * Embed actual images with proper sizing and borders
-          * Convert placeholder descriptions to elegant caption boxes
-          * Maintain visual consistency throughout
-        - Ensure the final document is print-ready and publication-quality
-        
-        Output should be a complete HTML document that converts seamlessly to professional PDF.
-        """,
-        agent=agents['content_formatter'],
-        expected_output=f"""
-        A professionally formatted HTML document containing:
-        - Complete HTML structure with embedded CSS
-        - Story title with elegant typography and styling
-        - 5 chapters with:
-          * Professional chapter headers
-          * Properly formatted and placed images or styled captions
-          * Well-typeset chapter content (~100 words each)
-          * Consistent formatting throughout
-        - Print-ready CSS with:
-          * Professional color scheme and typography
-          * Proper page margins and spacing
-          * Optimized for PDF conversion
-          * Mobile-responsive design as bonus
-        - Publication-quality layout suitable for sharing or printing
-        
-        The document should look like a professionally published children's book.
-        """,
-        context=[task_write, task_image_generate],
-        output_file=OUTPUT_MARKDOWN.replace('.md', '.html')  # Output as HTML instead of markdown
-    )
+    # Task 3: Generate Images from the chapter plans in the outline
+    if 'images' not in saved:
+        prompt, context = _with_upstream(prompts['images'], tasks, saved, TASK_GRAPH['images'])
+        tasks['images'] = Task(
+            **prompt,
+            agent=image_generator,
+            context=context,
+            output_pydantic=ChapterImages,
+            async_execution='images' in _CONCURRENT_TASKS,
+            callback=checkpointed('images', layout('images'), to_text=_complete_images_json)
+        )
 
-    # Task 5: Convert to Professional PDF
-    task_markdown_to_pdf = Task(
-        description=f"""
-        Convert the professionally formatted HTML document to a high-quality PDF suitable for printing and sharing.
-        
-        Requirements:
-        - Use the formatted HTML document as input (not raw markdown)
-        - Preserve all professional formatting, typography, and styling
-        - Ensure images are properly embedded and sized
-        - Handle page breaks elegantly
-        - Create a print-ready document with:
-          * Proper margins for binding
-          * Consistent page layout
-          * High-quality image rendering
-          * Professional typography
-        - Try multiple conversion methods in this order:
-          1. WeasyPrint (best for complex layouts and CSS)
-          2. Puppeteer/Playwright (if available)
-          3. wkhtmltopdf (reliable fallback)
-        - Provide detailed feedback on conversion success
-        - If conversion fails, provide specific installation instructions
-        - Ensure the final PDF is ready for:
-          * Professional printing
-          * Digital sharing
-          * E-book reading
-          * Archive storage
-        
-        The output should be a publication-quality PDF that looks like a professionally published children's book.
-        """,
-        agent=agents['markdown_to_pdf_creator'],
-        expected_output=f"""
-        Either:
-        - A high-quality PDF file path (if conversion succeeds) with:
-          * Professional book layout and typography
-          * Properly embedded and sized images
-          * Consistent formatting throughout
-          * Print-ready quality suitable for publication
-          * Optimized file size for sharing
-        
-        OR (if conversion fails):
-        - Clear error message with specific tool installation instructions
-        - Confirmation that the HTML file was created successfully
-        - Alternative conversion methods and online tools
-        - Detailed troubleshooting steps
-        
-        The PDF should be indistinguishable from a professionally published children's book,
-        suitable for printing, sharing, or commercial use.
-        """,
-        context=[task_format_content]
+    # Task 4: Convert to Professional PDF (its upstream tasks are context only so it
+    # waits for them; restored outputs are not needed, the layout is already on disk)
+    tasks['pdf'] = Task(
+        **prompts['pdf'],
+        agent=markdown_to_pdf_creator,
+        context=[tasks[kind] for kind in TASK_GRAPH['pdf'] if kind in tasks],
+        async_execution='pdf' in _CONCURRENT_TASKS
     )
     
-    return [task_outline, task_write, task_image_generate, task_format_content, task_markdown_to_pdf]
\ No newline at end of file
+    return list(tasks.values())
\ No newline at end of file
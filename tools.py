@@ -1,36 +1,91 @@
 import os
 import re
+import json
+import hashlib
+import importlib.util
+import functools
 import requests
 import subprocess
+import sys
 import shutil
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+from typing import List
 from crewai_tools import tool
-from crewai_tools.tools import FileReadTool
-from config import HF_API_URL, HF_HEADERS, TEMPLATE_FILE
-from PIL import Image
-from io import BytesIO
+from models import Manuscript, task_output_model, task_output_text
+from config import HF_API_URL, HF_SESSION, HF_MAX_CONCURRENT_REQUESTS, FLUX_CACHE_DIR, OUTPUT_MARKDOWN, PDF_CONVERSION_TIMEOUT
 import markdown
 import tempfile
 import platform
 import html
+import mimetypes
+from urllib.parse import urlparse, unquote
 
-# File reading tool
-file_read_tool = FileReadTool(
-    file_path=TEMPLATE_FILE,
-    description='A tool to read the Story Template file and understand the expected output format.'
-)
+# Patterns used on every image and PDF build, compiled once
+_SAFE_RE = re.compile(r'[^a-zA-Z0-9_]')
+_IMG_RE = re.compile(r'!\[([^\]]*)\]\(([^)]+)\)')
+_CHAPTER_RE = re.compile(r'^## (Chapter \d+[^#\n]*)', re.MULTILINE)
+_HTML_IMG_SRC_RE = re.compile(r'<img[^>]*\ssrc="([^"]+)"')
 
-@tool
-def generate_image_flux(chapter_content_and_character_details: str) -> str:
+# Caps in-flight FLUX requests across every caller (batch tool, single-image retries,
+# concurrent pipelines), not just within one batch
+_HF_SLOTS = threading.BoundedSemaphore(HF_MAX_CONCURRENT_REQUESTS)
+
+# JSON encoder for request bodies: orjson when installed, the standard library otherwise
+try:
+    import orjson
+    _json_bytes = orjson.dumps
+except ImportError:
+    def _json_bytes(obj) -> bytes:
+        return json.dumps(obj).encode('utf-8')
+
+_JSON_HEADERS = {'Content-Type': 'application/json'}
+
+# Markdown renderer: markdown-it-py when installed (much faster on long documents),
+# Python-Markdown otherwise
+try:
+    from markdown_it import MarkdownIt
+    _MARKDOWN_IT = MarkdownIt('commonmark').enable(['table', 'strikethrough'])
+except ImportError:
+    _MARKDOWN_IT = None
+
+def _flux_cache_path(payload: dict) -> str:
+    """Content-addressed cache path of a FLUX request: the same model and payload map to the same file."""
+    request = json.dumps([HF_API_URL, payload], sort_keys=True)
+    key = hashlib.blake2b(request.encode('utf-8'), digest_size=16).hexdigest()
+    return os.path.join(FLUX_CACHE_DIR, f"{key}.png")
+
+def _place_cached_image(cache_path: str, filepath: str) -> None:
+    """Expose a cached image under its human-readable name, hard-linking when possible."""
+    if os.path.exists(filepath):
+        os.remove(filepath)
+    try:
+        os.link(cache_path, filepath)
+    except OSError:
+        shutil.copyfile(cache_path, filepath)
+
+def _stream_to_cache(response, cache_path: str) -> None:
     """
-    Generates an image for a given chapter using FLUX.1-dev model from Hugging Face.
-    Saves it in the current folder and returns the image path.
-    If generation fails, returns a descriptive placeholder.
-    
-    Args:
-        chapter_content_and_character_details (str): Content describing the chapter scene and characters
-        
-    Returns:
-        str: Path to the generated image file or placeholder description
+    Stream the PNG bytes as returned into the cache, chunk by chunk, without holding the
+    whole image in memory; decoding and re-encoding them gains nothing.
+    """
+    os.makedirs(FLUX_CACHE_DIR, exist_ok=True)
+    tmp_path = f"{cache_path}.{threading.get_ident()}.tmp"
+    try:
+        with open(tmp_path, 'wb') as f:
+            for chunk in response.iter_content(chunk_size=64 * 1024):
+                f.write(chunk)
+        os.replace(tmp_path, cache_path)
+    except BaseException:
+        _discard(tmp_path)
+        raise
+
+def _generate_image(chapter_content_and_character_details: str, chapter: int = None) -> str:
+    """
+    Generate and save one FLUX.1-dev image, returning its path or a placeholder.
+    Shared by the single-image and batch tools. When a chapter number is given it
+    prefixes the filename, so concurrent chapters never write to the same file.
     """
     try:
         # Create a detailed prompt for FLUX
@@ -53,30 +108,43 @@ def generate_image_flux(chapter_content_and_character_details: str) -> str:
             }
         }
         
+        # Generate filename from content
+        words = chapter_content_and_character_details.split()[:5]
+        safe_words = [_SAFE_RE.sub('', word) for word in words]
+        filename = "_".join(safe_words).lower() + ".png"
+        if chapter is not None:
+            filename = f"chapter_{chapter}_{filename}"
+        filepath = os.path.join(os.getcwd(), filename)
+        
+        # An identical request made before is served from the image cache
+        cache_path = _flux_cache_path(payload)
+        if os.path.exists(cache_path):
+            _place_cached_image(cache_path, filepath)
+            print(f"♻️  Reused cached image: {filepath}")
+            return filepath
+        
         print(f"🎨 Generating image for: {chapter_content_and_character_details[:50]}...")
-        response = requests.post(HF_API_URL, headers=HF_HEADERS, json=payload, timeout=60)
+        with _HF_SLOTS:
+            response = HF_SESSION.post(HF_API_URL, data=_json_bytes(payload), headers=_JSON_HEADERS, timeout=60, stream=True)
+            with response:
+                if response.status_code == 200:
+                    _stream_to_cache(response, cache_path)
+                else:
+                    error_text = response.text  # Read before the connection is released
         
         if response.status_code == 200:
-            # Generate filename from content
-            words = chapter_content_and_character_details.split()[:5]
-            safe_words = [re.sub(r'[^a-zA-Z0-9_]', '', word) for word in words]
-            filename = "_".join(safe_words).lower() + ".png"
-            filepath = os.path.join(os.getcwd(), filename)
-            
-            # Save the image
-            image = Image.open(BytesIO(response.content))
-            image.save(filepath)
+            _place_cached_image(cache_path, filepath)
             
             print(f"✅ Image saved: {filepath}")
             return filepath
         else:
             print(f"❌ Failed to generate image. Status code: {response.status_code}")
             if response.status_code == 429:
-                print("⚠️  Rate limit exceeded. Using placeholder description.")
+                print("⚠️  Rate limit still exceeded after retries. Using placeholder description.")
             elif response.status_code == 503:
-                print("⚠️  Service temporarily unavailable. Using placeholder description.")
+                print("⚠️  Service still unavailable after retries. Using placeholder description.")
             else:
-                print(f"Response: {response.text}")
+                print(f"Response: {error_text}")
             
             # Return placeholder description
             return f"PLACEHOLDER: {chapter_content_and_character_details[:100]}..."
@@ -88,8 +156,75 @@ def generate_image_flux(chapter_content_and_character_details: str) -> str:
         print(f"❌ Error generating image: {str(e)}")
         return f"PLACEHOLDER: {chapter_content_and_character_details[:100]}..."
 
+@tool
+def generate_image_flux(chapter_content_and_character_details: str) -> str:
+    """
+    Generates an image for a given chapter using FLUX.1-dev model from Hugging Face.
+    Saves it in the current folder and returns the image path.
+    If generation fails, returns a descriptive placeholder.
+    
+    Args:
+        chapter_content_and_character_details (str): Content describing the chapter scene and characters
+        
+    Returns:
+        str: Path to the generated image file or placeholder description
+    """
+    return _generate_image(chapter_content_and_character_details)
+
+def generate_images_flux_concurrent(prompts: List[str]) -> List[str]:
+    """
+    Generate one image per prompt with all FLUX requests in flight at once.
+    Returns image paths or placeholders aligned with the input order.
+    """
+    if not prompts:
+        return []
+    
+    workers = min(HF_MAX_CONCURRENT_REQUESTS, len(prompts))
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        return list(executor.map(_generate_image, prompts, range(1, len(prompts) + 1)))
+
+@tool
+def generate_images_batch(chapter_descriptions: List[str]) -> str:
+    """
+    Generates the images for all chapters at once using FLUX.1-dev model from Hugging Face.
+    The requests are sent concurrently, so this is much faster than one call per chapter.
+    Failed chapters get a descriptive placeholder instead of an image path.
+    
+    Args:
+        chapter_descriptions (List[str]): One scene and character description per chapter, in chapter order
+        
+    Returns:
+        str: One line per chapter with the image path or placeholder description
+    """
+    if not chapter_descriptions:
+        return "❌ No chapter descriptions provided."
+    
+    print(f"🎨 Generating {len(chapter_descriptions)} images concurrently...")
+    results = generate_images_flux_concurrent(chapter_descriptions)
+    
+    return "\n".join(f"- Chapter {i}: {result}" for i, result in enumerate(results, 1))
+
+def save_manuscript_draft(task_output) -> None:
+    """
+    Task callback that writes the story writer's manuscript to the output markdown
+    file as soon as it is finished, before images and formatting run.
+    """
+    manuscript = task_output_model(task_output, Manuscript)
+    text = manuscript.to_markdown() if isinstance(manuscript, Manuscript) else task_output_text(task_output) + "\n"
+    write_manuscript_draft(text)
+
+def write_manuscript_draft(text: str) -> None:
+    """Write manuscript markdown (or unparsed manuscript text) to the output markdown file."""
+    try:
+        with open(OUTPUT_MARKDOWN, 'w', encoding='utf-8') as f:
+            f.write(text)
+        print(f"📝 Manuscript saved to {OUTPUT_MARKDOWN}")
+    except OSError as e:
+        print(f"⚠️  Could not save manuscript draft: {e}")
+
+@functools.lru_cache(maxsize=1)
 def setup_fontconfig():
-    """Setup fontconfig environment to avoid font errors."""
+    """Setup fontconfig environment to avoid font errors (once per process)."""
     try:
         # Check if we're in a problematic environment
         if platform.system() == "Linux":
@@ -153,33 +288,39 @@ def setup_fontconfig():
         print(f"⚠️  Could not setup fontconfig: {e}")
         return False
 
+@functools.lru_cache(maxsize=1)
 def check_pdf_tools():
-    """Check which PDF conversion tools are available."""
+    """Check which PDF conversion tools are available (probed once per process)."""
     tools_available = {}
     
-    # Check mdpdf
-    try:
-        subprocess.run(['mdpdf', '--help'], capture_output=True, check=True)
-        tools_available['mdpdf'] = True
-    except (subprocess.CalledProcessError, FileNotFoundError):
-        tools_available['mdpdf'] = False
-    
-    # Check wkhtmltopdf (for pdfkit)
-    try:
-        subprocess.run(['wkhtmltopdf', '--version'], capture_output=True, check=True)
-        tools_available['wkhtmltopdf'] = True
-    except (subprocess.CalledProcessError, FileNotFoundError):
-        tools_available['wkhtmltopdf'] = False
+    # Check mdpdf and wkhtmltopdf (for pdfkit) by looking them up on PATH,
+    # without launching them
+    tools_available['mdpdf'] = shutil.which('mdpdf') is not None
+    tools_available['wkhtmltopdf'] = shutil.which('wkhtmltopdf') is not None
     
-    # Check weasyprint
-    try:
-        import weasyprint
-        tools_available['weasyprint'] = True
-    except ImportError:
-        tools_available['weasyprint'] = False
+    # Check weasyprint by locating the package, without paying for its import
+    tools_available['weasyprint'] = importlib.util.find_spec('weasyprint') is not None
     
     return tools_available
 
+def _import_pdf_tools() -> None:
+    if check_pdf_tools().get('weasyprint'):
+        try:
+            # Configure fontconfig before weasyprint loads it
+            setup_fontconfig()
+            importlib.import_module('weasyprint')
+        except Exception as e:
+            print(f"⚠️  weasyprint is installed but failed to import: {str(e)}")
+
+def warm_pdf_tools() -> None:
+    """
+    Probe the PDF tools and import weasyprint in a background thread, so the slow
+    import overlaps the story generation instead of delaying the PDF step.
+    """
+    if 'weasyprint' in sys.modules:
+        return  # Already imported by an earlier run
+    threading.Thread(target=_import_pdf_tools, name='pdf-tools-probe', daemon=True).start()
+
 def preprocess_markdown(md_content: str) -> str:
     """
     Preprocess the markdown content to handle images and formatting better.
@@ -191,24 +332,26 @@ def preprocess_markdown(md_content: str) -> str:
         
         if src.startswith("PLACEHOLDER:"):
             # Convert placeholder to styled description
-            description = src.replace("PLACEHOLDER:", "").strip()
+            description = html.escape(src.replace("PLACEHOLDER:", "").strip())
             return f'<div class="image-placeholder"><em>📖 {description}</em></div>'
         else:
             # Keep regular images
-            return f'<img src="{src}" alt="{alt_text}" class="chapter-image">'
+            return f'<img src="{html.escape(src)}" alt="{html.escape(alt_text)}" class="chapter-image">'
     
-    # Replace markdown images with processed versions
-    md_content = re.sub(r'!\[([^\]]*)\]\(([^)]+)\)', replace_placeholder_images, md_content)
+    # Replace markdown images with processed versions (skipping the scan when there are none)
+    if '![' in md_content:
+        md_content = _IMG_RE.sub(replace_placeholder_images, md_content)
     
-    # Ensure proper chapter breaks
-    md_content = re.sub(r'^## (Chapter \d+[^#\n]*)', r'<div class="chapter-break"></div>\n## \1', md_content, flags=re.MULTILINE)
+    # Ensure proper chapter breaks (the blank line ends the HTML block before the heading)
+    if '## Chapter' in md_content:
+        md_content = _CHAPTER_RE.sub(r'<div class="chapter-break"></div>\n\n## \1', md_content)
     
     return md_content
 
-def get_enhanced_css():
-    """Get enhanced CSS for better PDF formatting."""
-    return """
-    <style>
+# Enhanced CSS for PDF formatting, split into blocks keyed on a marker in the HTML.
+# A block is only sent to the renderer when its marker appears (None: always needed).
+_CSS_BLOCKS = (
+    (None, """
         @page {
             size: A4;
             margin: 2cm;
@@ -245,10 +388,31 @@ def get_enhanced_css():
             margin: 30pt 0 15pt 0;
             padding: 10pt 0 5pt 15pt;
             border-left: 4pt solid #3498db;
-            background-color: #f8f9fa;
             page-break-after: avoid;
         }
         
+        p {
+            margin: 0 0 12pt 0;
+            text-align: left;
+            text-indent: 20pt;
+        }
+        
+        /* Print-specific adjustments */
+        @media print {
+            body {
+                font-size: 11pt;
+            }
+            
+            h1 {
+                font-size: 22pt;
+            }
+            
+            h2 {
+                font-size: 16pt;
+            }
+        }
+"""),
+    ('chapter-break', """
         .chapter-break {
             page-break-before: always;
             height: 0;
@@ -257,15 +421,8 @@ def get_enhanced_css():
         .chapter-break:first-child {
             page-break-before: auto;
         }
-        
-        p {
-            margin: 0 0 12pt 0;
-            text-align: justify;
-            text-indent: 20pt;
-            orphans: 2;
-            widows: 2;
-        }
-        
+"""),
+    ('chapter-image', """
         .chapter-image {
             display: block;
             max-width: 100%;
@@ -274,8 +431,10 @@ def get_enhanced_css():
             border: 1pt solid #ddd;
             border-radius: 8pt;
             box-shadow: 0 2pt 4pt rgba(0,0,0,0.1);
+            page-break-inside: avoid;
         }
-        
+"""),
+    ('image-placeholder', """
         .image-placeholder {
             margin: 20pt 0;
             padding: 15pt;
@@ -283,6 +442,7 @@ def get_enhanced_css():
             border: 2pt dashed #3498db;
             border-radius: 8pt;
             text-align: center;
+            page-break-inside: avoid;
         }
         
         .image-placeholder em {
@@ -291,7 +451,8 @@ def get_enhanced_css():
             font-size: 11pt;
             line-height: 1.4;
         }
-        
+"""),
+    ('<li', """
         /* Table of Contents styling if present */
         ul {
             list-style-type: none;
@@ -303,36 +464,86 @@ def get_enhanced_css():
             padding: 5pt 0;
             border-bottom: 1pt dotted #ccc;
         }
-        
-        /* Ensure good page breaks */
-        h1, h2 {
-            page-break-after: avoid;
-        }
-        
-        p {
-            page-break-inside: avoid;
-        }
-        
-        .chapter-image, .image-placeholder {
-            page-break-inside: avoid;
-        }
-        
-        /* Print-specific adjustments */
-        @media print {
-            body {
-                font-size: 11pt;
-            }
-            
-            h1 {
-                font-size: 22pt;
-            }
-            
-            h2 {
-                font-size: 16pt;
-            }
-        }
-    </style>
+"""),
+)
+
+@functools.lru_cache(maxsize=16)
+def _css_for(markers: tuple) -> str:
+    return "\n    <style>" + "".join(css for marker, css in _CSS_BLOCKS if marker in markers) + "    </style>\n    "
+
+def get_enhanced_css(html_content: str = None) -> str:
+    """
+    Get enhanced CSS for better PDF formatting. Given the rendered HTML, only the
+    blocks it uses are included, so the PDF renderer parses fewer unused rules.
+    """
+    markers = tuple(
+        marker for marker, _ in _CSS_BLOCKS
+        if marker is None or html_content is None or marker in html_content
+    )
+    return _css_for(markers)
+
+def _markdown_extensions(md_content: str, *extra: str) -> list:
+    """Markdown extensions for this content; code highlighting and the TOC only when used."""
+    extensions = ['extra', *extra]
+    if '```' in md_content or '~~~' in md_content:
+        extensions.append('codehilite')
+    if '[TOC]' in md_content:
+        extensions.append('toc')
+    return extensions
+
+def _markdown_to_html(markdown_file_name: str) -> str:
+    """Preprocess a Markdown file and convert it to an HTML fragment."""
+    with open(markdown_file_name, 'r', encoding='utf-8') as f:
+        md_content = f.read()
+    
+    # Preprocess the markdown
+    processed_md = preprocess_markdown(md_content)
+    
+    # Convert markdown to HTML: markdown-it covers the storybook's markdown, while
+    # code highlighting and the TOC still need the Python-Markdown extensions
+    extensions = _markdown_extensions(processed_md, 'tables')
+    if _MARKDOWN_IT is not None and not {'codehilite', 'toc'} & set(extensions):
+        return _MARKDOWN_IT.render(processed_md)
+    return markdown.markdown(processed_md, extensions=extensions)
+
+# Fixed parts of the styled HTML document, around the stylesheet and the story
+_HTML_HEAD = """
+        <!DOCTYPE html>
+        <html lang="en">
+        <head>
+            <meta charset="utf-8">
+            <meta name="viewport" content="width=device-width, initial-scale=1">
+            <title>Children's Storybook</title>
+            """
+_HTML_BODY = """
+        </head>
+        <body>
+            """
+_HTML_TAIL = """
+        </body>
+        </html>
+        """
+
+def _render_html(markdown_file_name: str) -> str:
+    """
+    Render a Markdown file as the complete, styled HTML document the HTML-based
+    PDF converters print. Done once per conversion and shared by every converter.
     """
+    html_content = _markdown_to_html(markdown_file_name)
+    return "".join((_HTML_HEAD, get_enhanced_css(html_content), _HTML_BODY, html_content, _HTML_TAIL))
+
+@functools.lru_cache(maxsize=1)
+def _mdpdf_css_path() -> str:
+    """Write the full stylesheet for mdpdf once per process and return its path."""
+    css = get_enhanced_css().replace('<style>', '').replace('</style>', '')
+    path = os.path.join(
+        tempfile.gettempdir(),
+        f"storybook-{hashlib.sha256(css.encode('utf-8')).hexdigest()[:16]}.css"
+    )
+    if not os.path.exists(path):
+        with open(path, 'w', encoding='utf-8') as f:
+            f.write(css)
+    return path
 
 def convert_with_mdpdf(markdown_file_name: str, output_file: str) -> bool:
     """Try converting with mdpdf - enhanced version."""
@@ -348,25 +559,21 @@ def convert_with_mdpdf(markdown_file_name: str, output_file: str) -> bool:
         temp_md.write(preprocess_markdown(md_content))
         temp_md.close()
         
-        # Use mdpdf with custom CSS
-        css_file = tempfile.NamedTemporaryFile(mode='w', suffix='.css', delete=False, encoding='utf-8')
-        css_file.write(get_enhanced_css().replace('<style>', '').replace('</style>', ''))
-        css_file.close()
-        
+        # Use mdpdf with the custom CSS written once for this process
         cmd = [
             'mdpdf', 
             '--output', output_file,
-            '--css', css_file.name,
+            '--css', _mdpdf_css_path(),
             '--format', 'A4',
             '--margin', '2cm',
             temp_md.name
         ]
         
-        result = subprocess.run(cmd, capture_output=True, text=True, check=True)
-        
-        # Clean up temp files
-        os.unlink(temp_md.name)
-        os.unlink(css_file.name)
+        try:
+            subprocess.run(cmd, capture_output=True, text=True, check=True, timeout=PDF_CONVERSION_TIMEOUT)
+        finally:
+            # Clean up temp file
+            os.unlink(temp_md.name)
         
         print(f"✅ PDF created successfully with mdpdf: {output_file}")
         return True
@@ -378,8 +585,46 @@ def convert_with_mdpdf(markdown_file_name: str, output_file: str) -> bool:
         print(f"❌ mdpdf error: {str(e)}")
         return False
 
-def convert_with_weasyprint(markdown_file_name: str, output_file: str) -> bool:
-    """Try converting with weasyprint - enhanced version."""
+def _read_image(path: str):
+    try:
+        with open(path, 'rb') as f:
+            return path, f.read()
+    except OSError:
+        return path, None
+
+def _prefetching_url_fetcher(html_content: str, base_dir: str):
+    """
+    Read every local image the HTML references in parallel and return a WeasyPrint
+    url_fetcher serving them from memory, so layout never waits on sequential file reads.
+    """
+    from weasyprint import default_url_fetcher
+
+    paths = {
+        os.path.abspath(os.path.join(base_dir, unquote(src)))
+        for src in map(html.unescape, _HTML_IMG_SRC_RE.findall(html_content))
+        if urlparse(src).scheme in ('', 'file') and not src.startswith('//')
+    }
+    with ThreadPoolExecutor(max_workers=8) as pool:
+        images = {path: data for path, data in pool.map(_read_image, paths) if data is not None}
+
+    def url_fetcher(url, *args, **kwargs):
+        parsed = urlparse(url)
+        if parsed.scheme == 'file':
+            data = images.get(os.path.abspath(unquote(parsed.path)))
+            if data is not None:
+                return dict(string=data, mime_type=mimetypes.guess_type(parsed.path)[0], redirected_url=url)
+        return default_url_fetcher(url, *args, **kwargs)
+
+    return url_fetcher
+
+@functools.lru_cache(maxsize=1)
+def _weasyprint_font_config():
+    """Build WeasyPrint's font configuration once per process; scanning the fonts dominates startup."""
+    from weasyprint.text.fonts import FontConfiguration
+    return FontConfiguration()
+
+def convert_with_weasyprint(styled_html: str, output_file: str, base_dir: str = '.') -> bool:
+    """Try converting the rendered storybook HTML with weasyprint - enhanced version."""
     try:
         print("🔄 Trying weasyprint...")
         
@@ -390,44 +635,18 @@ def convert_with_weasyprint(markdown_file_name: str, output_file: str) -> bool:
         import warnings
         warnings.filterwarnings('ignore')
         
-        # Read and preprocess markdown
-        with open(markdown_file_name, 'r', encoding='utf-8') as f:
-            md_content = f.read()
-        
-        # Preprocess the markdown
-        processed_md = preprocess_markdown(md_content)
-        
-        # Convert markdown to HTML with extensions
-        html_content = markdown.markdown(
-            processed_md, 
-            extensions=['extra', 'codehilite', 'toc']
-        )
-        
-        # Create complete HTML document with enhanced styling
-        styled_html = f"""
-        <!DOCTYPE html>
-        <html lang="en">
-        <head>
-            <meta charset="utf-8">
-            <meta name="viewport" content="width=device-width, initial-scale=1">
-            <title>Children's Storybook</title>
-            {get_enhanced_css()}
-        </head>
-        <body>
-            {html_content}
-        </body>
-        </html>
-        """
-        
         # Import weasyprint components
-        from weasyprint import HTML, CSS
-        from weasyprint.text.fonts import FontConfiguration
+        from weasyprint import HTML
         
-        # Create a custom font configuration
-        font_config = FontConfiguration()
+        # Reuse the font configuration built by an earlier conversion
+        font_config = _weasyprint_font_config()
         
-        # Convert to PDF with enhanced settings
-        HTML(string=styled_html, base_url=os.path.dirname(os.path.abspath(markdown_file_name))).write_pdf(
+        # Convert to PDF with enhanced settings, serving the images read up front
+        HTML(
+            string=styled_html,
+            base_url=base_dir,
+            url_fetcher=_prefetching_url_fetcher(styled_html, base_dir)
+        ).write_pdf(
             output_file,
             font_config=font_config,
             optimize_images=True,
@@ -447,8 +666,8 @@ def convert_with_weasyprint(markdown_file_name: str, output_file: str) -> bool:
                 return True
         return False
 
-def convert_with_pdfkit(markdown_file_name: str, output_file: str) -> bool:
-    """Try converting with pdfkit - enhanced version."""
+def convert_with_pdfkit(styled_html: str, output_file: str) -> bool:
+    """Try converting the rendered storybook HTML with pdfkit - enhanced version."""
     try:
         print("🔄 Trying pdfkit...")
         
@@ -459,35 +678,6 @@ def convert_with_pdfkit(markdown_file_name: str, output_file: str) -> bool:
             print("❌ pdfkit not installed")
             return False
         
-        # Read and preprocess markdown
-        with open(markdown_file_name, 'r', encoding='utf-8') as f:
-            md_content = f.read()
-        
-        # Preprocess the markdown
-        processed_md = preprocess_markdown(md_content)
-        
-        # Convert markdown to HTML
-        html_content = markdown.markdown(
-            processed_md,
-            extensions=['extra', 'codehilite', 'toc']
-        )
-        
-        # Create complete HTML document
-        styled_html = f"""
-        <!DOCTYPE html>
-        <html lang="en">
-        <head>
-            <meta charset="utf-8">
-            <meta name="viewport" content="width=device-width, initial-scale=1">
-            <title>Children's Storybook</title>
-            {get_enhanced_css()}
-        </head>
-        <body>
-            {html_content}
-        </body>
-        </html>
-        """
-        
         # Enhanced options for better PDF generation
         options = {
             'page-size': 'A4',
@@ -522,17 +712,7 @@ def create_fallback_html(markdown_file_name: str) -> str:
         print("🔄 Creating enhanced HTML fallback...")
         html_output = os.path.splitext(markdown_file_name)[0] + '.html'
         
-        with open(markdown_file_name, 'r', encoding='utf-8') as f:
-            md_content = f.read()
-        
-        # Preprocess the markdown
-        processed_md = preprocess_markdown(md_content)
-        
-        # Convert to HTML with extensions
-        html_content = markdown.markdown(
-            processed_md,
-            extensions=['extra', 'codehilite', 'toc', 'tables']
-        )
+        html_content = _markdown_to_html(markdown_file_name)
         
         # Create complete HTML document
         styled_html = f"""
@@ -542,7 +722,7 @@ def create_fallback_html(markdown_file_name: str) -> str:
             <meta charset="utf-8">
             <meta name="viewport" content="width=device-width, initial-scale=1">
             <title>Children's Storybook</title>
-            {get_enhanced_css()}
+            {get_enhanced_css(html_content)}
             <style>
                 /* Additional screen-specific styles */
                 @media screen {{
@@ -594,6 +774,93 @@ def create_fallback_html(markdown_file_name: str) -> str:
         print(f"❌ HTML fallback creation failed: {str(e)}")
         return None
 
+def render_storybook(manuscript, images) -> str:
+    """
+    Lay out the finished story in Python: write the output markdown with each
+    chapter's image merged in, then render its styled HTML version.
+    
+    Args:
+        manuscript (Manuscript): The parsed manuscript, or None to keep the writer's draft
+        images (ChapterImages): The parsed chapter images, or None for no images
+        
+    Returns:
+        str: Path to the HTML file, or None if it could not be created
+    """
+    if manuscript is not None:
+        chapter_images = {i.number: i.image for i in images.images} if images else {}
+        with open(OUTPUT_MARKDOWN, 'w', encoding='utf-8') as f:
+            f.write(manuscript.to_markdown(chapter_images))
+    else:
+        print(f"⚠️  Manuscript could not be parsed; laying out the draft in {OUTPUT_MARKDOWN}")
+    
+    html_file = create_fallback_html(OUTPUT_MARKDOWN)
+    if html_file:
+        print(f"📄 Storybook laid out: {OUTPUT_MARKDOWN}, {html_file}")
+    return html_file
+
+def _is_valid_pdf(path: str) -> bool:
+    """A converter's output counts only if it exists and has real content (at least 1KB)."""
+    return os.path.exists(path) and os.path.getsize(path) > 1000
+
+def _discard(path: str) -> None:
+    """Remove a partial or losing output file, if one was written."""
+    try:
+        os.remove(path)
+    except OSError:
+        pass
+
+def race_pdf_converters(output_file: str, converters) -> str:
+    """
+    Run the converters concurrently, each into its own file, and keep the first
+    valid PDF as output_file. Slower converters are left to finish in the
+    background (mdpdf is killed by its subprocess timeout) and their output is discarded.
+    
+    Args:
+        output_file (str): Path the winning PDF is moved to
+        converters (list): (tool_name, convert_func) pairs, where convert_func
+                           takes the path to write its PDF to
+        
+    Returns:
+        str: Name of the winning converter, or None if none produced a PDF in time
+    """
+    base = os.path.splitext(output_file)[0]
+    executor = ThreadPoolExecutor(max_workers=len(converters))
+    pending = {}
+    for tool_name, convert_func in converters:
+        path = f"{base}.{tool_name}.pdf"
+        pending[executor.submit(convert_func, path)] = (tool_name, path)
+    
+    winner = None
+    deadline = time.monotonic() + PDF_CONVERSION_TIMEOUT
+    try:
+        while pending and winner is None:
+            done, _ = wait(pending, timeout=max(0, deadline - time.monotonic()), return_when=FIRST_COMPLETED)
+            if not done:
+                print(f"⚠️  PDF conversion timed out after {PDF_CONVERSION_TIMEOUT}s")
+                break
+            for future in done:
+                tool_name, path = pending.pop(future)
+                try:
+                    succeeded = future.result()
+                except Exception as e:
+                    print(f"❌ {tool_name} conversion failed with exception: {str(e)}")
+                    succeeded = False
+                
+                if winner is None and succeeded and _is_valid_pdf(path):
+                    os.replace(path, output_file)
+                    winner = tool_name
+                else:
+                    _discard(path)
+    finally:
+        # Drop whatever the slower converters write once they finish
+        for future, (_, path) in pending.items():
+            future.add_done_callback(lambda _, path=path: _discard(path))
+        executor.shutdown(wait=False)
+    
+    if winner:
+        print(f"🏁 {winner} finished first")
+    return winner
+
 @tool
 def convert_markdown_to_pdf(markdown_file_name: str) -> str:
     """
@@ -617,28 +884,32 @@ def convert_markdown_to_pdf(markdown_file_name: str) -> str:
     print(f"📄 Converting {markdown_file_name} to professionally formatted PDF...")
     print(f"Available tools: {available_tools}")
     
-    # Try each method in order of preference
+    # Conversion methods, their required tool, and whether they print the markdown or the rendered HTML
+    base_dir = os.path.dirname(os.path.abspath(markdown_file_name))
     conversion_methods = [
-        ('weasyprint', convert_with_weasyprint),  # Best for complex layouts
-        ('mdpdf', convert_with_mdpdf),           # Good for markdown
-        ('pdfkit', convert_with_pdfkit)          # Fallback option
+        ('weasyprint', 'weasyprint', functools.partial(convert_with_weasyprint, base_dir=base_dir), 'html'),  # Best for complex layouts
+        ('mdpdf', 'mdpdf', convert_with_mdpdf, 'markdown'),                                                   # Good for markdown
+        ('pdfkit', 'wkhtmltopdf', convert_with_pdfkit, 'html')                                                # Needs the wkhtmltopdf binary
     ]
+    available_methods = [method for method in conversion_methods if available_tools.get(method[1])]
     
-    for tool_name, convert_func in conversion_methods:
-        if available_tools.get(tool_name) or tool_name == 'weasyprint':
-            try:
-                if convert_func(markdown_file_name, output_file):
-                    # Verify the PDF was created and has content
-                    if os.path.exists(output_file) and os.path.getsize(output_file) > 1000:
-                        print(f"✅ Professional PDF created: {output_file}")
-                        print(f"📊 File size: {os.path.getsize(output_file)} bytes")
-                        return output_file
-                    else:
-                        print(f"⚠️  PDF file seems too small or empty")
-                        continue
-            except Exception as e:
-                print(f"❌ {tool_name} conversion failed with exception: {str(e)}")
-                continue
+    if available_methods:
+        # Render the styled HTML once, only if an HTML converter will print it
+        sources = {'markdown': markdown_file_name}
+        if any(source == 'html' for *_, source in available_methods):
+            sources['html'] = _render_html(markdown_file_name)
+        
+        # Race every available method; the first valid PDF wins
+        converters = [
+            (tool_name, functools.partial(convert_func, sources[source]))
+            for tool_name, _, convert_func, source in available_methods
+        ]
+        if race_pdf_converters(output_file, converters):
+            print(f"✅ Professional PDF created: {output_file}")
+            print(f"📊 File size: {os.path.getsize(output_file)} bytes")
+            return output_file
+    else:
+        print("❌ No PDF conversion tools found")
     
     # If all PDF methods failed, create enhanced HTML version
     html_file = create_fallback_html(markdown_file_name)